@@ -7,74 +7,130 @@
 # For appropriate heuristics, the graph is 'optimal' in its search efficiency
 # https://en.wikipedia.org/wiki/A*_search_algorithm
 
+# The open set is a binary heap with lazy deletion: improved nodes are pushed again and
+# out-of-date heap entries are skipped when they are popped
+# Costs, parents and heuristics are held in flat arrays indexed by node, and heuristics
+# are only evaluated for nodes the search actually reaches
+# Route latency scales as O(E log V) in the number of connections explored
+
+import heapq
+from array import array
 from typing import Callable
 
+UNREACHED = float('inf')
+NO_PARENT = -1
+
 
 def astar(number_of_nodes: int,
           heuristic_function: Callable[[int], float],
           cost_function: Callable[[int], list[tuple[int, float]]],
-          start: int) -> list:
+          start: int,
+          goals: set[int] | None = None,
+          admissible: bool = False) -> list:
     # number_of_nodes - the total number of nodes in the network
     # heuristic_function - function that takes a node index and returns the expected cost to goal (0 for a goal node)
     # cost_function - function that takes a node index and returns a list of (node, traversal cost) pairs
     #   for each node that can be reached directly in the network
     # start - the index of the start point
+    # goals - the indexes of the goal nodes, by default every node with heuristic 0
+    # admissible - True if the heuristic never overestimates the cost to a goal, so the search can stop
+    #   at the first goal it pops
 
-    # Create and initialize the all_nodes and goal_nodes lists
-    all_nodes: list[dict] = []
-    goal_nodes: list[int] = []
-    for i in range(number_of_nodes):
-        initial_cost = 1000000000
-        heuristic_cost = heuristic_function(i)
-        if heuristic_cost == 0:
-            goal_nodes.append(i)
-        all_nodes.append({
-            'index': i,
-            'parent': None,
-            'cost': initial_cost,
-            'heuristic': heuristic_cost,
-            'total': initial_cost + heuristic_cost,
-        })
-    if len(goal_nodes) == 0:
-        return []
-    start_node = all_nodes[start]
-    start_node['cost'] = 0
-    start_node['total'] = start_node['heuristic']
+    # Flat per-node storage, heuristic is NaN until the node is first reached
+    cost = array('d', [UNREACHED]) * number_of_nodes
+    heuristic = array('d', [float('nan')]) * number_of_nodes
+    parent = array('l', [NO_PARENT]) * number_of_nodes
+    closed_nodes: set[int] = set()
+
+    cost[start] = 0
+    heuristic[start] = heuristic_function(start)
 
-    # Initialize the open current_node list with the start current_node
-    open_nodes: list[int] = [start]
+    # Initialize the open node heap with the start node as (expected total cost, node index) pairs
+    open_nodes: list[tuple[float, int]] = [(heuristic[start], start)]
 
     # Main Algorithm
-    # Find the open current_node with the best expected total cost and explore
-    # all connections leading from it, adding new all_nodes (or old all_nodes with improved cost)
-    # to the open current_node list
-    while len(open_nodes) > 0:
-        open_nodes.sort(key=lambda node_index: all_nodes[node_index]['total'], reverse=True)
-        current_index, open_nodes = open_nodes[0], open_nodes[1:]
+    # Pop the open node with the best expected total cost and explore all connections leading from it,
+    # pushing nodes with improved cost onto the heap
+    # With an admissible heuristic no open node can lead to a cheaper goal than the first goal popped
+    # Otherwise goal nodes are recorded but not explored, and once a goal has been found any node
+    # that already costs as much as it is pruned, so the route stays optimal for inexact heuristics
+    end = None
+    while open_nodes:
+        total, current_index = heapq.heappop(open_nodes)
+        if current_index in closed_nodes or total > cost[current_index] + heuristic[current_index]:
+            continue
+        if end is not None and cost[current_index] >= cost[end]:
+            continue
+        if goals is not None:
+            is_goal = current_index in goals
+        else:
+            is_goal = heuristic[current_index] == 0
+        if is_goal:
+            end = current_index
+            if admissible:
+                break
+            continue
+        closed_nodes.add(current_index)
+        current_cost = cost[current_index]
         for i, weight in cost_function(current_index):
             if weight == 0 or i == current_index:
                 continue
-            current_node = all_nodes[current_index]
-            next_node = all_nodes[i]
-            new_cost = current_node['cost'] + weight
-            if new_cost < next_node['cost']:
-                next_node['cost'] = new_cost
-                next_node['total'] = next_node['heuristic'] + new_cost
-                next_node['parent'] = current_index
-                if i not in open_nodes and i not in goal_nodes:
-                    open_nodes.append(i)
-                if i in goal_nodes:
-                    break
+            new_cost = current_cost + weight
+            if new_cost < cost[i]:
+                if cost[i] == UNREACHED:
+                    heuristic[i] = heuristic_function(i)
+                cost[i] = new_cost
+                parent[i] = current_index
+                # Re-open a closed node if a cheaper route to it has been found
+                closed_nodes.discard(i)
+                heapq.heappush(open_nodes, (new_cost + heuristic[i], i))
 
     # Return the optimal route
-    end = sorted([(i, all_nodes[i]['total']) for i in goal_nodes], key=lambda x: x[1])[0][0]
+    if end is None:
+        return []
+    return trace_route(parent, start, end)
+
+
+def dijkstra(number_of_nodes: int,
+             cost_function: Callable[[int], list[tuple[int, float]]],
+             start: int,
+             goals: set[int] | None = None) -> tuple[array, array]:
+    # Single-source shortest paths, A* without a heuristic
+    # number_of_nodes, cost_function and start are as for astar
+    # goals - optional set of nodes, the search stops as soon as all of them have been reached
+    # Returns (cost, parent) arrays indexed by node: cost is inf and parent is NO_PARENT for unreachable nodes
+
+    cost = array('d', [UNREACHED]) * number_of_nodes
+    parent = array('l', [NO_PARENT]) * number_of_nodes
+    closed_nodes: set[int] = set()
+    remaining_goals = None if goals is None else set(goals)
+    cost[start] = 0
+    open_nodes: list[tuple[float, int]] = [(0, start)]
+    while open_nodes:
+        current_cost, current_index = heapq.heappop(open_nodes)
+        if current_index in closed_nodes:
+            continue
+        closed_nodes.add(current_index)
+        if remaining_goals is not None:
+            remaining_goals.discard(current_index)
+            if not remaining_goals:
+                break
+        for i, weight in cost_function(current_index):
+            if weight == 0 or i == current_index:
+                continue
+            new_cost = current_cost + weight
+            if new_cost < cost[i]:
+                cost[i] = new_cost
+                parent[i] = current_index
+                heapq.heappush(open_nodes, (new_cost, i))
+    return cost, parent
+
+
+def trace_route(parent: array, start: int, end: int) -> list:
+    # Follows the parent array back from end, returns the route from start or [] if end was not reached
     route = [end]
-    current = all_nodes[end]
-    while current['parent'] is not None:
-        route.append(current['parent'])
-        current = all_nodes[current['parent']]
-    route = route[::-1]
-    if route[0] != start:
+    while parent[route[-1]] != NO_PARENT:
+        route.append(parent[route[-1]])
+    if route[-1] != start:
         return []
-    else:
-        return route
+    return route[::-1]
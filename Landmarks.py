@@ -0,0 +1,154 @@
+# Route Finder Mobile
+# Landmarks.py
+# 17 October 2026
+
+# Landmark (ALT) heuristics for A* route finding
+# A few landmark nodes are chosen, and the exact route costs from each landmark to every node and from every
+# node to each landmark are found with Dijkstra. By the triangle inequality, for any landmark L
+#   cost(v, t) >= cost(L, t) - cost(L, v)   and   cost(v, t) >= cost(v, L) - cost(t, L)
+# so the largest of these bounds is a heuristic that never overestimates the cost from v to t (admissible)
+# Unlike the spring-layout heuristics, A* with landmark heuristics always finds optimal routes
+
+# Landmarks are stored in the map file from .rfo version 2025c (see RFO_File.py) as
+#   landmarks = [
+#       (node, [cost from node to every node], [cost from every node to node]),
+#   ]
+# and Network.find_best_route uses them in place of the spring heuristics when they are present
+
+# Add landmarks to a map, or report how far the spring heuristics of maps break admissibility, with:
+#   python Landmarks.py add maps/2023-SS-Campus-Map.rfo
+#   python Landmarks.py check maps/2023-SS-Campus-Map.rfo
+
+import sys
+
+import numpy as np
+
+from AStar import dijkstra
+
+LANDMARK_COUNT = 8
+
+
+class Landmarks:
+    """Exact route costs to and from a set of landmark nodes.
+    distance_from[k, v] is the cost from landmark k to node v and distance_to[k, v] the cost from node v
+    to landmark k, inf where there is no route."""
+
+    def __init__(self, nodes, distance_from, distance_to):
+        self.nodes = [int(node) for node in nodes]
+        self.distance_from = np.asarray(distance_from, dtype=np.float64).reshape(len(self.nodes), -1)
+        self.distance_to = np.asarray(distance_to, dtype=np.float64).reshape(len(self.nodes), -1)
+
+    def lower_bounds(self, end):
+        """Returns an array of lower bounds on the route cost from every node to end."""
+        with np.errstate(invalid='ignore'):
+            ahead = self.distance_from[:, end, None] - self.distance_from
+            behind = self.distance_to - self.distance_to[:, end, None]
+            bounds = np.fmax.reduce(np.fmax(ahead, behind), axis=0)
+        # Pairs of unreachable costs give no bound
+        bounds = np.where(np.isnan(bounds), 0, np.maximum(bounds, 0))
+        return bounds
+
+
+def reverse_edges(network):
+    """Returns, for each node, a list of (start, weight) pairs for the connections arriving at it."""
+    arriving = [[] for _ in network.names]
+    for start, end, weight in network.iter_edges():
+        arriving[end].append((start, weight))
+    return arriving
+
+
+def build_landmarks(network, count=LANDMARK_COUNT):
+    """Chooses up to count landmarks spread across the network and finds their exact route costs,
+    or returns None for an empty network.
+    Each landmark after the first is the node furthest (by the cost there and back) from those already chosen."""
+    node_count = len(network.names)
+    if node_count == 0:
+        return None
+    arriving = reverse_edges(network)
+
+    def costs_from_and_to(node):
+        return (np.asarray(dijkstra(node_count, network.edges_from, node)[0]),
+                np.asarray(dijkstra(node_count, arriving.__getitem__, node)[0]))
+
+    # The first landmark is the node furthest from node 0 that has a route there and back
+    cost_from, cost_to = costs_from_and_to(0)
+    round_trip = cost_from + cost_to
+    next_node = int(np.argmax(np.where(np.isinf(round_trip), -1, round_trip)))
+    nodes, distance_from, distance_to = [], [], []
+    # Nodes unreachable from every landmark so far are chosen next, as no other landmark bounds them
+    spread = np.full(node_count, np.inf)
+    while len(nodes) < count:
+        cost_from, cost_to = costs_from_and_to(next_node)
+        nodes.append(next_node)
+        distance_from.append(cost_from)
+        distance_to.append(cost_to)
+        spread = np.minimum(spread, cost_from + cost_to)
+        spread[nodes] = -1
+        next_node = int(np.argmax(spread))
+        if spread[next_node] < 0:
+            break
+    return Landmarks(nodes, distance_from, distance_to)
+
+
+def add_to_report(report, costs, estimates):
+    """Adds the heuristics from every node to one target, compared with the exact costs,
+    to a report, counting every node other than the target with a route to it."""
+    reachable = np.isfinite(costs) & (costs > 0)
+    cost, estimate = costs[reachable], estimates[reachable]
+    if len(cost) == 0:
+        return
+    ratio = estimate / cost
+    report['pairs'] += len(cost)
+    report['overestimates'] += int((estimate > cost + 1e-9).sum())
+    report['worst_ratio'] = max(report['worst_ratio'], float(ratio.max()))
+    report['worst_excess'] = max(report['worst_excess'], float((estimate - cost).max()))
+    report['ratio_sum'] += float(ratio.sum())
+
+
+def check_heuristics(network, landmarks=None):
+    """Returns reports for the spring heuristics, and the landmark heuristics if given, against the exact costs.
+    Each target is checked in turn, so memory use is proportional to the number of nodes."""
+    node_count = len(network.names)
+    arriving = reverse_edges(network)
+    kinds = ['spring'] if landmarks is None else ['spring', 'landmark']
+    reports = {kind: {'pairs': 0, 'overestimates': 0, 'worst_ratio': 0.0, 'worst_excess': 0.0, 'ratio_sum': 0.0}
+               for kind in kinds}
+    for end in range(node_count):
+        # Exact costs from every node to end, searching the connections backwards from end
+        costs = np.asarray(dijkstra(node_count, arriving.__getitem__, end)[0])
+        add_to_report(reports['spring'], costs, network.distances_from(network.heuristic_array[end], heuristic=True))
+        if landmarks is not None:
+            add_to_report(reports['landmark'], costs, landmarks.lower_bounds(end))
+    for report in reports.values():
+        report['mean_ratio'] = report.pop('ratio_sum') / report['pairs'] if report['pairs'] else 0.0
+    return reports
+
+
+if __name__ == "__main__":
+    from RFO_File import load_rfo, save_rfo
+
+    if len(sys.argv) > 2 and sys.argv[1] == "add":
+        for rfo_filename in sys.argv[2:]:
+            data = load_rfo(rfo_filename)
+            if data is None:
+                print(rfo_filename, "could not be read")
+                continue
+            version, map_filename, scale, units, rfo_network = data
+            rfo_network.landmarks = build_landmarks(rfo_network)
+            save_rfo(rfo_filename, scale, units, rfo_network, map_filename)
+            print(rfo_filename, "landmarks", rfo_network.landmarks.nodes)
+    elif len(sys.argv) > 2 and sys.argv[1] == "check":
+        for rfo_filename in sys.argv[2:]:
+            data = load_rfo(rfo_filename)
+            if data is None:
+                print(rfo_filename, "could not be read")
+                continue
+            rfo_network = data[4]
+            check_landmarks = rfo_network.landmarks or build_landmarks(rfo_network)
+            for kind, report in check_heuristics(rfo_network, check_landmarks).items():
+                print(f"{rfo_filename} {kind} heuristic: "
+                      f"{report['overestimates']} of {report['pairs']} routes overestimated, "
+                      f"worst {report['worst_ratio']:.2f}x (+{report['worst_excess']:.1f}), "
+                      f"mean {report['mean_ratio']:.2f}x of the route cost")
+    else:
+        print("usage: python Landmarks.py add|check <.rfo files>")
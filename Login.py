@@ -21,12 +21,13 @@
 
 
 import tkinter as tk
-from PIL import ImageTk, Image
 from pysqlcipher3 import dbapi2 as sqlite
 import bcrypt
 import json
 import os
 
+from ResourceManager import ResourceManager
+
 
 # Database setup
 USER_DATABASE = "users.db"
@@ -96,15 +97,14 @@ class LoginApp:
         else:
             self.root.geometry(geometry)
 
+        # UI assets, this also starts preloading the images used by the Route Finder screens
+        self.resources = ResourceManager(path="ui_components")
+
         # Frame overlay
-        self.frame_image = Image.open(f"ui_components/frame.png")
-        self.frame_image = self.frame_image.resize(self.frame, Image.Resampling.LANCZOS)
-        self.frame_photo = ImageTk.PhotoImage(self.frame_image)
+        self.frame_photo = self.resources.load("frame", self.frame[1], self.frame[0])
 
         # Login overlay
-        self.login_image = Image.open(f"ui_components/Screen 7/Foreground.png")
-        self.login_image = self.login_image.resize(self.login_frame, Image.Resampling.LANCZOS)
-        self.login_photo = ImageTk.PhotoImage(self.login_image)
+        self.login_photo = self.resources.load("Screen 7/Foreground", self.login_frame[1], self.login_frame[0])
 
         # UI Elements used across screens
         self.username_entry = None
@@ -0,0 +1,172 @@
+# Route Finder Mobile
+# MapCache.py
+# 16 October 2026
+
+# Compiled binary cache of an .rfo map, saved alongside it as an '.rfb' file
+# load_map returns the same values as load_rfo, but after the first load of a map it
+# memory-maps the compiled arrays instead of parsing text, so start-up is near instant and
+# the pages are shared by every process that has the same map open
+
+# The '.rfb' file layout is:
+#   magic bytes b'RFB1', then an 8 byte little-endian header length
+#   a JSON header with the map details, node names, the source .rfo mtime, size and sha1 hash,
+#   and the dtype, offset and length of each array
+#   the arrays in native byte order, each starting on an 8 byte boundary:
+#       locations, heuristics - N x 2 float64
+#       edge_offsets, edge_targets - int64 CSR connection arrays (see Network.py)
+#       edge_weights - int64 when every weight is a whole number, otherwise float64
+#       landmark_nodes - int64, landmark_from, landmark_to - K x N float64, only for maps with landmarks
+
+# The cache is used when the source mtime and size match, or failing that when its hash matches,
+# and is rewritten whenever the source has changed, or with the new mtime after a match by hash
+
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from Network import Network
+from Landmarks import Landmarks
+from RFO_File import load_rfo
+
+MAGIC = b'RFB1'
+FORMAT_VERSION = 2
+RFO_EXTENSION = '.rfo'
+COMPILED_EXTENSION = '.rfb'
+ALIGNMENT = 8
+
+
+def compiled_filename(rfo_filename):
+    if rfo_filename.endswith(RFO_EXTENSION):
+        rfo_filename = rfo_filename[:-len(RFO_EXTENSION)]
+    return rfo_filename + COMPILED_EXTENSION
+
+
+def _file_hash(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_stamp(rfo_filename):
+    status = os.stat(rfo_filename)
+    return {'mtime_ns': status.st_mtime_ns, 'size': status.st_size}
+
+
+def save_compiled(filename, rfo_filename, version, map_filename, scale, units, network, source_hash=None):
+    # source_hash - the sha1 of the .rfo file if already known
+    weights_are_ints = all(float(w).is_integer() for w in network.edge_weights)
+    arrays = {
+        'locations': np.ascontiguousarray(network.location_array, dtype=np.float64),
+        'heuristics': np.ascontiguousarray(network.heuristic_array, dtype=np.float64),
+        'edge_offsets': np.array(network.edge_offsets, dtype=np.int64),
+        'edge_targets': np.array(network.edge_targets, dtype=np.int64),
+        'edge_weights': np.array(network.edge_weights, dtype=np.int64 if weights_are_ints else np.float64),
+    }
+    if network.landmarks is not None:
+        arrays['landmark_nodes'] = np.array(network.landmarks.nodes, dtype=np.int64)
+        arrays['landmark_from'] = np.ascontiguousarray(network.landmarks.distance_from, dtype=np.float64)
+        arrays['landmark_to'] = np.ascontiguousarray(network.landmarks.distance_to, dtype=np.float64)
+    header = {
+        'format': FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'source': dict(_source_stamp(rfo_filename), sha1=source_hash or _file_hash(rfo_filename)),
+        'version': version,
+        'map_filename': map_filename,
+        'scale': scale,
+        'units': units,
+        'names': network.names,
+        'arrays': {},
+    }
+    # Array offsets depend on the header length, so lay out the arrays after a padded header
+    header_bytes = json.dumps(header).encode()
+    data_start = 0
+    while True:
+        offset = data_start
+        for name, values in arrays.items():
+            header['arrays'][name] = {'dtype': values.dtype.str, 'shape': values.shape, 'offset': offset}
+            offset += -(-values.nbytes // ALIGNMENT) * ALIGNMENT
+        header_bytes = json.dumps(header).encode()
+        needed = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+        if needed <= data_start:
+            break
+        data_start = needed
+    header_bytes = header_bytes.ljust(data_start - len(MAGIC) - 8)
+    temp_filename = filename + '.tmp'
+    try:
+        with open(temp_filename, 'wb') as file:
+            file.write(MAGIC)
+            file.write(len(header_bytes).to_bytes(8, 'little'))
+            file.write(header_bytes)
+            for name, values in arrays.items():
+                file.seek(header['arrays'][name]['offset'])
+                values.tofile(file)
+            file.truncate(offset)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
+def _map_array(filename, info):
+    dtype, shape = np.dtype(info['dtype']), tuple(info['shape'])
+    if 0 in shape:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode='r', offset=info['offset'], shape=shape)
+
+
+def load_compiled(filename, rfo_filename):
+    """Returns (version, map_filename, scale, units, network) from a compiled map,
+    or None if it is missing, unreadable or out of date."""
+    try:
+        with open(filename, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                return None
+            header_length = int.from_bytes(file.read(8), 'little')
+            header = json.loads(file.read(header_length))
+        if header['format'] != FORMAT_VERSION or header['byteorder'] != sys.byteorder:
+            return None
+        source = header['source']
+        stamp = _source_stamp(rfo_filename)
+        stamp_matches = (stamp['mtime_ns'], stamp['size']) == (source['mtime_ns'], source['size'])
+        if not stamp_matches and (stamp['size'] != source['size'] or _file_hash(rfo_filename) != source['sha1']):
+            return None
+        arrays = {name: _map_array(filename, info) for name, info in header['arrays'].items()}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    network = Network.from_csr(names=header['names'],
+                               locations=arrays['locations'],
+                               heuristics=arrays['heuristics'],
+                               edge_offsets=memoryview(arrays['edge_offsets']),
+                               edge_targets=memoryview(arrays['edge_targets']),
+                               edge_weights=memoryview(arrays['edge_weights']))
+    if 'landmark_nodes' in arrays:
+        network.landmarks = Landmarks(arrays['landmark_nodes'], arrays['landmark_from'], arrays['landmark_to'])
+    data = header['version'], header['map_filename'], header['scale'], header['units'], network
+    if not stamp_matches:
+        # Matched by hash, so record the new mtime to skip hashing next time
+        try:
+            save_compiled(filename, rfo_filename, *data, source_hash=source['sha1'])
+        except OSError:
+            pass
+    return data
+
+
+def load_map(rfo_filename):
+    """Loads an .rfo map through its compiled cache, compiling it first if needed."""
+    cache_filename = compiled_filename(rfo_filename)
+    data = load_compiled(cache_filename, rfo_filename)
+    if data is not None:
+        return data
+    data = load_rfo(rfo_filename)
+    if data is not None:
+        try:
+            save_compiled(cache_filename, rfo_filename, *data)
+        except OSError:
+            pass
+    return data
@@ -8,53 +8,347 @@
 #   heuristic location of nodes
 #   connection weights between nodes
 
+# Node locations and heuristic locations are held in contiguous N x 2 float arrays:
+#   location_array, heuristic_array
+# so distance, bounding box and screen transform queries run over every node at once
+# The locations and heuristics attributes are read-only sequences of Vector views over their rows,
+# and assigning a list of Vectors (or coordinate pairs) to them replaces the array
+
+# select_by_location, nodes_near and nodes_in_rect use a grid SpatialIndex over the node locations,
+# built when first needed and rebuilt whenever the locations are replaced
+
+# Connections are held in compressed sparse row (CSR) form:
+#   edge_offsets - edges leaving node i are at positions edge_offsets[i] to edge_offsets[i + 1]
+#   edge_targets - the end node of each edge, sorted within each node's section
+#   edge_weights - the weight of each edge
+# so neighbour queries are O(degree) and memory is O(E)
+# The connections attribute is a read-only {(start, end): weight} view over these arrays
+
+# find_best_route keeps a bounded LRU cache of recent routes, and reads routes from a
+# precomputed next-hop table (see RouteTable.py) instead of searching when one is attached
+
+# A* is guided by the straight-line distance between heuristic locations, which can overestimate route costs,
+# or, when the map file holds landmarks (see Landmarks.py), by landmark lower bounds that never do
+# Landmarks are discarded when the connections change, as their route costs no longer hold
+
 # Important methods
 #   draw - renders the network to a canvas using the node locations as pixel locations
 #   find_best_route - identifies the least-cost path between two nodes
+#   find_routes - identifies the least-cost paths for many (start, end) pairs, sharing one search per start
+#   nearest_of - identifies the least-cost path from a node to the nearest of a set of candidates
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
-from AStar import astar
-from FuzzyNameSearch import find_best_match
+from AStar import astar, dijkstra, trace_route
+from FuzzyNameSearch import SearchIndex
+from SpatialIndex import SpatialIndex
 from Vector import Vector
 
 
+class Connections(Mapping):
+    """Read-only {(start, end): weight} view over the CSR arrays of a Network."""
+
+    def __init__(self, network):
+        self.network = network
+
+    def __getitem__(self, key):
+        i, j = key
+        network = self.network
+        if not 0 <= i < len(network.edge_offsets) - 1:
+            raise KeyError(key)
+        lo, hi = network.edge_offsets[i], network.edge_offsets[i + 1]
+        k = bisect_left(network.edge_targets, j, lo, hi)
+        if k < hi and network.edge_targets[k] == j:
+            return network.edge_weights[k]
+        raise KeyError(key)
+
+    def __iter__(self):
+        network = self.network
+        for i in range(len(network.edge_offsets) - 1):
+            for k in range(network.edge_offsets[i], network.edge_offsets[i + 1]):
+                yield i, network.edge_targets[k]
+
+    def __len__(self):
+        return len(self.network.edge_targets)
+
+
+class VectorView(Sequence):
+    """Read-only sequence of Vectors viewing the rows of an N x 2 coordinate array."""
+
+    def __init__(self, coordinates):
+        self.coordinates = coordinates
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Vector.view(row) for row in self.coordinates[index]]
+        return Vector.view(self.coordinates[index])
+
+    def __len__(self):
+        return len(self.coordinates)
+
+
+def coordinate_array(points):
+    """Returns an N x 2 float array from an array, or a sequence of Vectors or coordinate pairs."""
+    if isinstance(points, VectorView):
+        points = points.coordinates
+    if not isinstance(points, np.ndarray):
+        points = [p.as_tuple() if isinstance(p, Vector) else p for p in points]
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+# Network used by find_routes worker processes, set once per process by the pool initializer
+_worker_network = None
+
+
+def _init_route_worker(network):
+    global _worker_network
+    _worker_network = network
+
+
+def _routes_from_worker(start, ends):
+    return _worker_network.routes_from(start, ends)
+
+
 class Network:
 
-    def __init__(self, nodes, connection_matrix):
+    ROUTE_CACHE_SIZE = 256
+
+    def __init__(self, nodes, connection_matrix=None, edges=None):
+        # nodes - list of node dicts with 'id', 'name', 'location' and 'heuristic'
+        # connection_matrix - dense N x N list of connection weights (0 for no connection)
+        # edges - alternatively, an iterable of (start, end, weight) triples
         self.names: list[str] = []
-        self.locations: list[Vector] = []
-        self.heuristics: list[Vector] = []
-        self.connections: dict = {}
+        self.location_array = np.empty((0, 2))
+        self.heuristic_array = np.empty((0, 2))
+        self.edge_offsets = array('l', [0])
+        self.edge_targets = array('l')
+        self.edge_weights: list = []
+        self.connections = Connections(self)
+        self.route_table = None
+        self.route_cache: OrderedDict = OrderedDict()
+        self.search_index = None
+        self.location_index = None
+        self.landmarks = None
         if nodes is not None:
             sorted_nodes = sorted(nodes, key=lambda x: x['id'])
             self.names = [node['name'] for node in sorted_nodes]
-            self.locations = [Vector(*node['location']) for node in sorted_nodes]
-            self.heuristics = [Vector(*node['heuristic']) for node in sorted_nodes]
-            self.connections = {(i, j): w
-                                for i, row in enumerate(connection_matrix)
-                                for j, w in enumerate(row) if w != 0}
+            self.locations = [node['location'] for node in sorted_nodes]
+            self.heuristics = [node['heuristic'] for node in sorted_nodes]
+            if edges is None:
+                edges = ((i, j, w) for i, row in enumerate(connection_matrix or []) for j, w in enumerate(row))
+            self.set_edges(edges)
 
-    def select_by_location(self, location, tolerance=10):
-        v_location = Vector(*location)
-        for i, n_loc in enumerate(self.locations):
-            if n_loc.distance(v_location) <= tolerance:
-                return i
-        else:
+    @classmethod
+    def from_csr(cls, names, locations, heuristics, edge_offsets, edge_targets, edge_weights):
+        """Creates a Network directly from node arrays and CSR connection arrays without rebuilding them.
+        The arrays may be any indexable sequences, such as memoryviews of a memory-mapped file."""
+        network = cls(None)
+        network.names = list(names)
+        network.locations = locations
+        network.heuristics = heuristics
+        network.edge_offsets = edge_offsets
+        network.edge_targets = edge_targets
+        network.edge_weights = edge_weights
+        return network
+
+    @property
+    def locations(self):
+        return VectorView(self.location_array)
+
+    @locations.setter
+    def locations(self, points):
+        self.location_array = coordinate_array(points)
+
+    @property
+    def heuristics(self):
+        return VectorView(self.heuristic_array)
+
+    @heuristics.setter
+    def heuristics(self, points):
+        self.heuristic_array = coordinate_array(points)
+
+    def __getstate__(self):
+        # Memory-mapped arrays cannot be pickled, so copy them when sending a Network to another process
+        state = dict(self.__dict__)
+        for key, value in state.items():
+            if isinstance(value, memoryview):
+                state[key] = value.tolist()
+            elif isinstance(value, np.memmap):
+                state[key] = np.array(value)
+        return state
+
+    def set_edges(self, edges):
+        """Rebuilds the CSR arrays from an iterable of (start, end, weight) triples."""
+        rows: list[dict] = [{} for _ in range(len(self.names))]
+        for i, j, w in edges:
+            if w != 0:
+                rows[i][j] = w
+        self.edge_offsets = array('l', [0])
+        self.edge_targets = array('l')
+        self.edge_weights = []
+        for row in rows:
+            for j in sorted(row):
+                self.edge_targets.append(j)
+                self.edge_weights.append(row[j])
+            self.edge_offsets.append(len(self.edge_targets))
+        self.route_table = None
+        self.landmarks = None
+        self.route_cache.clear()
+
+    def iter_edges(self):
+        """Yields (start, end, weight) for every connection in start, end order."""
+        for i in range(len(self.edge_offsets) - 1):
+            for k in range(self.edge_offsets[i], self.edge_offsets[i + 1]):
+                yield i, self.edge_targets[k], self.edge_weights[k]
+
+    def edges_from(self, node):
+        """Returns a list of (end, weight) pairs for the connections leaving a node."""
+        lo, hi = self.edge_offsets[node], self.edge_offsets[node + 1]
+        return list(zip(self.edge_targets[lo:hi], self.edge_weights[lo:hi]))
+
+    def distances_from(self, point, heuristic=False):
+        """Returns an array of the distances from a point to every node location (or heuristic location)."""
+        coordinates = self.heuristic_array if heuristic else self.location_array
+        offsets = coordinates - np.asarray(point, dtype=np.float64)
+        return np.hypot(offsets[:, 0], offsets[:, 1])
+
+    def bounding_box(self, heuristic=False):
+        """Returns (min_x, min_y, max_x, max_y) of the node locations (or heuristic locations)."""
+        coordinates = self.heuristic_array if heuristic else self.location_array
+        if len(coordinates) == 0:
             return None
+        (min_x, min_y), (max_x, max_y) = coordinates.min(axis=0), coordinates.max(axis=0)
+        return float(min_x), float(min_y), float(max_x), float(max_y)
+
+    def screen_points(self, scale, zoom, position, offset, nodes=None):
+        """Returns an array of screen points for node locations, all nodes if nodes is None.
+        Screen point = location * scale * zoom - position + offset, as for RouteFinder's map view."""
+        coordinates = self.location_array if nodes is None else self.location_array[np.asarray(nodes, dtype=np.intp)]
+        return coordinates * (scale * zoom) - np.asarray(position, dtype=np.float64) + np.asarray(offset, dtype=np.float64)
+
+    def spatial_index(self):
+        """Returns the spatial index over the node locations, rebuilding it if the locations have changed."""
+        if self.location_index is None or self.location_index.points is not self.location_array:
+            self.location_index = SpatialIndex(self.location_array)
+        return self.location_index
+
+    def select_by_location(self, location, tolerance=10):
+        """Returns the node nearest to location if it is within tolerance, otherwise returns None."""
+        return self.spatial_index().nearest(location, tolerance)
+
+    def nodes_near(self, location, radius):
+        """Returns the nodes within radius of location, nearest first."""
+        return self.spatial_index().within_radius(location, radius)
+
+    def nodes_in_rect(self, rect):
+        """Returns the nodes inside an (x, y, width, height) rectangle."""
+        return self.spatial_index().in_rect(rect)
+
+    def name_index(self):
+        """Returns the search index over the node names, rebuilding it if the names have changed."""
+        if self.search_index is None or self.search_index.names != self.names:
+            self.search_index = SearchIndex(self.names)
+        return self.search_index
 
     def select_by_name(self, search_text):
-        return find_best_match(search_text, self.names)
+        return self.name_index().find_best_match(search_text)
 
     def matrix(self):
-        new_matrix = [[0 for _ in range(len(self.locations))] for _ in range(len(self.locations))]
-        for (i, j), weight in self.connections.items():
-            new_matrix[i][j] = weight
+        new_matrix = [[0 for _ in range(len(self.names))] for _ in range(len(self.names))]
+        for i, row in enumerate(new_matrix):
+            for j, weight in self.edges_from(i):
+                row[j] = weight
         return new_matrix
 
     def find_best_route(self, start, end):
-        return astar(number_of_nodes=len(self.heuristics),
-                     heuristic_function=lambda x: self.heuristics[x].distance(self.heuristics[end]),
-                     cost_function=lambda x: [(j, w) for ((i, j), w) in self.connections.items() if i == x],
-                     start=start)
+        if (start, end) in self.route_cache:
+            self.route_cache.move_to_end((start, end))
+            return list(self.route_cache[(start, end)])
+        if self.route_table is not None:
+            route = self.route_from_table(start, end)
+        else:
+            heuristic, admissible = self.route_heuristic(end)
+            route = astar(number_of_nodes=len(self.names),
+                          heuristic_function=heuristic.__getitem__,
+                          cost_function=self.edges_from,
+                          start=start,
+                          goals={end},
+                          admissible=admissible)
+        self.route_cache[(start, end)] = route
+        if len(self.route_cache) > self.ROUTE_CACHE_SIZE:
+            self.route_cache.popitem(last=False)
+        return list(route)
+
+    def route_heuristic(self, end):
+        """Returns (heuristic, admissible): the A* heuristic to end for every node as a list,
+        from the landmarks if there are any, and whether it never overestimates."""
+        if self.landmarks is not None:
+            return self.landmarks.lower_bounds(end).tolist(), True
+        return self.distances_from(self.heuristic_array[end], heuristic=True).tolist(), False
+
+    def routes_from(self, start, ends):
+        """Returns {end: route} for each end, using a single search from start."""
+        ends = set(ends)
+        if self.route_table is not None:
+            return {end: self.route_from_table(start, end) for end in ends}
+        cost, parent = dijkstra(len(self.names), self.edges_from, start, goals=ends)
+        return {end: trace_route(parent, start, end) for end in ends}
+
+    def find_routes(self, pairs, processes=None):
+        """Returns the best route for each (start, end) pair, in the same order as pairs.
+        Pairs that share a start share one search; with processes > 1 the starts are
+        divided between a pool of worker processes."""
+        pairs = list(pairs)
+        ends_by_start: dict[int, list[int]] = {}
+        for start, end in pairs:
+            ends_by_start.setdefault(start, []).append(end)
+        if processes is not None and processes > 1 and len(ends_by_start) > 1:
+            with ProcessPoolExecutor(max_workers=processes,
+                                     initializer=_init_route_worker,
+                                     initargs=(self,)) as pool:
+                routes = dict(zip(ends_by_start, pool.map(_routes_from_worker,
+                                                           ends_by_start.keys(),
+                                                           ends_by_start.values())))
+        else:
+            routes = {start: self.routes_from(start, ends) for start, ends in ends_by_start.items()}
+        return [list(routes[start][end]) for start, end in pairs]
+
+    def nearest_of(self, start, candidates):
+        """Returns the best route from start to whichever candidate node is cheapest to reach."""
+        candidates = set(candidates)
+        if not candidates:
+            return []
+        # Distance from every node to its closest candidate, exactly 0 at the candidates themselves
+        if self.landmarks is not None:
+            heuristic = np.min([self.landmarks.lower_bounds(end) for end in candidates], axis=0)
+        else:
+            goal_offsets = self.heuristic_array[:, None, :] - self.heuristic_array[list(candidates)][None, :, :]
+            heuristic = np.hypot(goal_offsets[..., 0], goal_offsets[..., 1]).min(axis=1)
+        heuristic[list(candidates)] = 0
+        heuristic = heuristic.tolist()
+        return astar(number_of_nodes=len(self.names),
+                     heuristic_function=heuristic.__getitem__,
+                     cost_function=self.edges_from,
+                     start=start,
+                     goals=candidates,
+                     admissible=self.landmarks is not None)
+
+    def route_from_table(self, start, end):
+        """Follows the precomputed next-hop table from start to end."""
+        node_count = len(self.names)
+        route = [start]
+        while route[-1] != end:
+            next_hop = self.route_table[route[-1] * node_count + end]
+            if next_hop < 0:
+                return []
+            route.append(next_hop)
+        return route
 
     def turn(self, nodes):
         v1: Vector = self.locations[nodes[1]] - self.locations[nodes[0]]
@@ -21,71 +21,242 @@ connections = [
     [100, 0],
 ]
 """
+# Version 2025b stores only the non-zero connections as (start, end, weight) triples,
+# so file size and load time scale with the number of connections rather than nodes squared
+"""
+connections = [
+    (0, 1, 100),
+    (1, 0, 100),
+]
+"""
+# Version 2025c may follow the connections with landmarks (see Landmarks.py), each with the exact route cost
+# from the landmark to every node and from every node to the landmark, inf where there is no route
+"""
+landmarks = [
+    (1, [100.0, 0.0], [100.0, 0.0]),
+]
+"""
+# Older version files can be migrated to the current version with
+#   python RFO_File.py migrate maps/2023-SS-Campus-Map.rfo
 
-import re
+import os
+import sys
+import time
 
 from Network import Network
 
-VERSION_CODE = "2025a"
-valid_versions = ["2025a"]
+from Landmarks import Landmarks
 
+VERSION_CODE = "2025c"
+valid_versions = ["2025a", "2025b", "2025c"]
 
-def save_rfo(filename, scale, units, network, map_filename):
+
+def save_rfo(filename, scale, units, network, map_filename, version=VERSION_CODE):
     with open(filename, 'w') as file:
         file.write("# Route Finder Map File\n")
-        file.write(f"# Version {VERSION_CODE}\n")
+        file.write(f"# Version {version}\n")
         file.write("\n")
         file.write(f"map_filename = '{map_filename}'\n")
         file.write(f"scale = {scale}\n")
         file.write(f"units = '{units}'\n")
         file.write("nodes = [\n")
         for i, (name, location, heuristic) in enumerate(zip(network.names, network.locations, network.heuristics)):
-            file.write(f"    {{'id': {i}, 'name': '{name}', 'location': {tuple([round(x, 1) for x in location])}"
-                       f", 'heuristic': {tuple([round(x, 1) for x in heuristic])}}},\n")
+            location = tuple([round(x, 1) for x in location.as_tuple()])
+            heuristic = tuple([round(x, 1) for x in heuristic.as_tuple()])
+            file.write(f"    {{'id': {i}, 'name': '{name}', 'location': {location}, 'heuristic': {heuristic}}},\n")
         file.write("]\n")
         file.write("connections = [\n")
-        for connection_row in network.matrix():
-            file.write(f"    {connection_row},\n")
+        if version == "2025a":
+            for connection_row in network.matrix():
+                file.write(f"    {connection_row},\n")
+        else:
+            for start, end, weight in network.iter_edges():
+                file.write(f"    ({start}, {end}, {weight}),\n")
         file.write("]")
+        if version not in ("2025a", "2025b") and network.landmarks is not None:
+            file.write("\nlandmarks = [\n")
+            landmarks = network.landmarks
+            for k, node in enumerate(landmarks.nodes):
+                file.write(f"    ({node}, {landmarks.distance_from[k].tolist()}, {landmarks.distance_to[k].tolist()}),\n")
+            file.write("]")
+
+
+def migrate_rfo(filename):
+    """Rewrites an .rfo file in the current version, returns False if it could not be read."""
+    data = load_rfo(filename)
+    if data is None:
+        return False
+    version, map_filename, scale, units, network = data
+    if version != VERSION_CODE:
+        save_rfo(filename, scale, units, network, map_filename)
+    return True
+
+
+def _read_lines(file):
+    """Yields the stripped, non-blank lines of a file one at a time."""
+    for line in file:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def _parse_value(line, key):
+    """Returns the value text of a 'key = value' line, raising ValueError for any other line."""
+    line_key, separator, value = line.partition(" = ")
+    if line_key != key or not separator:
+        raise ValueError(f"Expected '{key} = ...' but found {line!r}")
+    return value
+
+
+def _parse_quoted(text):
+    if len(text) < 2 or text[0] != "'" or text[-1] != "'":
+        raise ValueError(f"Expected a quoted string but found {text!r}")
+    return text[1:-1]
+
+
+def _parse_pair(text):
+    x, y = text.split(", ")
+    return float(x), float(y)
+
+
+def _parse_node(line):
+    """Decodes one node line: {'id': 0, 'name': 'Reception', 'location': (1.0, 2.0), 'heuristic': (3.0, 4.0)},"""
+    body = line.rstrip(",")
+    if not (body.startswith("{'id': ") and body.endswith(")}")):
+        raise ValueError(f"Invalid node line {line!r}")
+    id_text, name_text = body[len("{'id': "):-len(")}")].split(", 'name': '", 1)
+    name, location_text = name_text.rsplit("', 'location': (", 1)
+    location_text, heuristic_text = location_text.split("), 'heuristic': (")
+    return {
+        'id': int(id_text),
+        'name': name,
+        'location': _parse_pair(location_text),
+        'heuristic': _parse_pair(heuristic_text)
+    }
+
+
+def _parse_connection_rows(lines, node_count):
+    """Yields (start, end, weight) for each non-zero cell of the dense connection rows."""
+    for i in range(node_count):
+        line = next(lines, "")
+        if not (line.startswith("[") and line.rstrip(",").endswith("]")):
+            raise ValueError(f"Invalid connection row {line!r}")
+        cells = line.rstrip(",")[1:-1].split(",")
+        if len(cells) != node_count:
+            raise ValueError(f"Connection row {i} has {len(cells)} entries, expected {node_count}")
+        for j, cell in enumerate(cells):
+            weight = int(float(cell))
+            if weight != 0:
+                yield i, j, weight
+    if next(lines, "") != "]":
+        raise ValueError("Expected end of connections")
+
+
+def _parse_connection_triples(lines, node_count):
+    """Yields (start, end, weight) for each connection triple line until the closing bracket."""
+    for line in lines:
+        if line == "]":
+            return
+        if not (line.startswith("(") and line.rstrip(",").endswith(")")):
+            raise ValueError(f"Invalid connection line {line!r}")
+        start_text, end_text, weight_text = line.rstrip(",")[1:-1].split(",")
+        start, end, weight = int(start_text), int(end_text), float(weight_text)
+        if not (0 <= start < node_count and 0 <= end < node_count):
+            raise ValueError(f"Connection {start}, {end} refers to a missing node")
+        yield start, end, int(weight) if weight.is_integer() else weight
+    raise ValueError("Expected end of connections")
+
+
+def _parse_costs(text, node_count):
+    costs = [float(cost) for cost in text.split(",")] if text else []
+    if len(costs) != node_count:
+        raise ValueError(f"Landmark has {len(costs)} costs, expected {node_count}")
+    return costs
+
+
+def _parse_landmarks(lines, node_count):
+    """Returns Landmarks from the landmark lines until the closing bracket."""
+    nodes, distance_from, distance_to = [], [], []
+    for line in lines:
+        if line == "]":
+            return Landmarks(nodes, distance_from, distance_to) if nodes else None
+        body = line.rstrip(",")
+        if not (body.startswith("(") and body.endswith("])")):
+            raise ValueError(f"Invalid landmark line {line!r}")
+        node_text, from_text, to_text = body[1:-2].split(", [")
+        node = int(node_text)
+        if not 0 <= node < node_count:
+            raise ValueError(f"Landmark {node} refers to a missing node")
+        nodes.append(node)
+        distance_from.append(_parse_costs(from_text.rstrip("]"), node_count))
+        distance_to.append(_parse_costs(to_text, node_count))
+    raise ValueError("Expected end of landmarks")
 
 
 def load_rfo(filename):
     with open(filename, 'r') as file:
-        data = ''.join([line.strip() for line in file.readlines()])
-        p = re.compile(
-            r"# Route Finder Map File"
-            r"# Version (.*)"
-            r"map_filename = '(.*)'"
-            r"scale = ([\d.]+)"
-            r"units = '(.*)'"
-            r"nodes = \[(.*)]"
-            r"connections = (.*)"
-        )
-        match = p.match(data)
-        if match is not None:
-            version, filename, scale, units, node_text, connections_text = match.groups()
+        lines = _read_lines(file)
+        try:
+            if next(lines) != "# Route Finder Map File":
+                return None
+            version_line = next(lines)
+            if not version_line.startswith("# Version "):
+                return None
+            version = version_line[len("# Version "):]
             if version not in valid_versions:
                 return None
+            map_filename = _parse_quoted(_parse_value(next(lines), "map_filename"))
+            scale = float(_parse_value(next(lines), "scale"))
+            units = _parse_quoted(_parse_value(next(lines), "units"))
+            if _parse_value(next(lines), "nodes") != "[":
+                return None
             nodes = []
-            p_node = re.compile(r"'id': (.*), 'name': '(.*)', 'location': \(([^,]*), ([^)]*)\), "
-                                r"'heuristic': \(([^,]*), ([^)]*)\)")
-            for node_line in node_text.strip('{}').split('},{'):
-                node_match = p_node.match(node_line)
-                n_id, n_name, n_location_x, n_location_y, n_heuristic_x, n_heuristic_y = node_match.groups()
-                nodes.append({
-                    'id': int(n_id),
-                    'name': n_name,
-                    'location': (float(n_location_x), float(n_location_y)),
-                    'heuristic': (float(n_heuristic_x), float(n_heuristic_y))
-                })
-            node_count = len(nodes)
-            p_connections = re.compile(r"[\d.]+")
-            connections_match = p_connections.findall(connections_text)
-            if len(connections_match) != node_count ** 2:
+            for line in lines:
+                if line == "]":
+                    break
+                nodes.append(_parse_node(line))
+            if _parse_value(next(lines), "connections") != "[":
                 return None
-            connections = [[0 for _ in range(node_count)] for _ in range(node_count)]
-            for i in range(node_count):
-                for j in range(node_count):
-                    connections[i][j] = int(float(connections_match[i * node_count + j]))
-            return version, filename, float(scale), units, Network(nodes, connections)
-    return None
+            if version == "2025a":
+                edges = _parse_connection_rows(lines, len(nodes))
+            else:
+                edges = _parse_connection_triples(lines, len(nodes))
+            network = Network(nodes, edges=edges)
+            landmarks_line = next(lines, None)
+            if landmarks_line is not None:
+                if version in ("2025a", "2025b") or _parse_value(landmarks_line, "landmarks") != "[":
+                    return None
+                network.landmarks = _parse_landmarks(lines, len(nodes))
+        except (StopIteration, ValueError, IndexError):
+            return None
+        return version, map_filename, scale, units, network
+
+
+def benchmark_load_rfo(filename, loads=200):
+    """Prints the parse throughput of load_rfo for a file."""
+    file_size = os.path.getsize(filename)
+    start_time = time.perf_counter()
+    for _ in range(loads):
+        load_rfo(filename)
+    elapsed = time.perf_counter() - start_time
+    print(f"{filename}: {loads} loads in {elapsed:.3f}s, "
+          f"{elapsed / loads * 1000:.3f}ms per load, "
+          f"{file_size * loads / elapsed / 1e6:.2f}MB/s")
+
+
+if __name__ == "__main__":
+    # python RFO_File.py migrate <files> - rewrite .rfo files in the current version
+    # python RFO_File.py - parse-throughput benchmark against the bundled campus map in both versions
+    if len(sys.argv) > 2 and sys.argv[1] == "migrate":
+        for rfo_filename in sys.argv[2:]:
+            print(rfo_filename, "migrated" if migrate_rfo(rfo_filename) else "could not be read")
+    else:
+        import tempfile
+
+        BENCHMARK_FILE = "maps/2023-SS-Campus-Map.rfo"
+        benchmark_load_rfo(BENCHMARK_FILE)
+        _, benchmark_map_filename, benchmark_scale, benchmark_units, benchmark_network = load_rfo(BENCHMARK_FILE)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sparse_filename = os.path.join(temp_dir, "sparse.rfo")
+            save_rfo(sparse_filename, benchmark_scale, benchmark_units, benchmark_network, benchmark_map_filename)
+            benchmark_load_rfo(sparse_filename)
@@ -2,36 +2,60 @@
 # ResourceManager.py
 # 13 July 2025
 
+import bisect
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from PIL import Image, ImageTk
 
 class ContextManager:
-    """Class that manages the lifetime of UI assets"""
+    """Class that manages the lifetime of UI assets.
+    Assets are indexed by each of their contexts, so switching context only visits the assets it removes,
+    and are kept in stacking order (highest priority number first) as they are added."""
     def __init__(self):
         self.context_assets = dict()
+        self.context_index = dict()
+        self.stacking = []
+        self.sequence = dict()
+        self.lifted = []
 
     def manage_context(self, tag, asset, contexts, destructor, priority=99):
         """Manages the lifetime of UI assets across mode changes and other context changes."""
-        if tag in self.context_assets or tag == 'all':
-            old_asset = self.context_assets[tag]['asset']
-            self.context_assets[tag]['destructor'](old_asset)
+        if tag in self.context_assets:
+            self.context_assets[tag]['destructor'](self.context_assets[tag]['asset'])
+            self.remove_asset(tag)
         self.context_assets[tag] = {
             'asset': asset,
             'destructor': destructor,
             'contexts': contexts,
             'priority': priority
         }
+        for context in contexts:
+            self.context_index.setdefault(context, set()).add(tag)
+        # Equal priorities keep the order in which their tags were first managed
+        self.sequence.setdefault(tag, len(self.sequence))
+        bisect.insort(self.stacking, (-priority, self.sequence[tag], tag))
+
+    def remove_asset(self, tag):
+        """Removes an asset from the indexes without destroying it."""
+        info = self.context_assets.pop(tag)
+        for context in info['contexts']:
+            self.context_index[context].discard(tag)
+        self.stacking.remove((-info['priority'], self.sequence[tag], tag))
 
     def switch_context(self, context):
         """Switches the current context and deletes assets no longer required."""
-        for tag, info in self.context_assets.items():
-            if context in info['contexts'] or context == 'all':
-                self.context_assets[tag]['destructor'](info['asset'])
-                self.context_assets[tag] = {
-                    'asset': None,
-                    'destructor': lambda x: None,
-                    'contexts': [],
-                    'priority': 99
-                }
+        if context == 'all':
+            tags = list(self.context_assets)
+        else:
+            tags = list(self.context_index.get(context, ()))
+        for tag in tags:
+            self.context_assets[tag]['destructor'](self.context_assets[tag]['asset'])
+            self.remove_asset(tag)
 
     def get_asset(self, tag):
         """Returns a managed asset if it is still valid, otherwise returns None."""
@@ -41,22 +65,107 @@ class ContextManager:
             return None
 
     def reorder_assets(self, reorder_fn):
-        """Allows the assets to be ordered based on their priority level."""
-        prioritised = sorted(self.context_assets.items(), key=lambda x: x[1]['priority'], reverse=True)
-        self.context_assets = dict(prioritised)
-        for tag, info in prioritised:
-            reorder_fn(info['asset'])
+        """Allows the assets to be ordered based on their priority level.
+        Assets already in order since the last reorder are skipped, and reorder_fn is called from the first
+        asset that has been added or moved onwards."""
+        stacked = [(tag, self.context_assets[tag]['asset']) for _, _, tag in self.stacking]
+        previous = [(tag, asset) for tag, asset in self.lifted
+                    if tag in self.context_assets and self.context_assets[tag]['asset'] is asset]
+        first_change = 0
+        while first_change < len(previous) and stacked[first_change][0] == previous[first_change][0]:
+            first_change += 1
+        for tag, asset in stacked[first_change:]:
+            reorder_fn(asset)
+        self.lifted = stacked
+
+
+class AssetAtlas:
+    """Decoded and resized UI images shared by every ResourceManager using the same asset folder.
+    Images listed in the folder's manifest are prepared on a background thread at start-up, and
+    each resized image is saved in a cache folder so later runs skip the resampling."""
+    cache_folder = '.resized'
+    manifest_name = 'manifest.json'
+    atlases = dict()
+
+    def __init__(self, path):
+        self.asset_path = path
+        self.images = dict()
+        self.lock = threading.Lock()
+        self.preload_thread = None
+
+    @classmethod
+    def shared(cls, path):
+        """Returns the atlas for an asset folder, creating it the first time."""
+        if path not in cls.atlases:
+            cls.atlases[path] = cls(path)
+        return cls.atlases[path]
+
+    def cache_filename(self, name, size, width):
+        return os.path.join(self.asset_path, self.cache_folder, f"{name}@{width}x{size}.png")
+
+    def prepare(self, name, size, width):
+        """Returns an asset as a loaded PIL image at the given size, from the disk cache when it is up to date."""
+        source_filename = f"{self.asset_path}/{name}.png"
+        if size is None:
+            image = Image.open(source_filename)
+            image.load()
+            return image
+        cache_filename = self.cache_filename(name, size, width)
+        try:
+            if os.path.getmtime(cache_filename) >= os.path.getmtime(source_filename):
+                image = Image.open(cache_filename)
+                image.load()
+                return image
+        except OSError:
+            pass
+        image = Image.open(source_filename).resize((width, size), Image.Resampling.LANCZOS)
+        try:
+            os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+            image.save(cache_filename, compress_level=1)
+        except OSError:
+            pass
+        return image
+
+    def get(self, name, size=None, width=None):
+        """Returns a prepared image, preparing it now if the preload has not reached it yet."""
+        key = (name, size, width)
+        with self.lock:
+            image = self.images.get(key)
+        if image is None:
+            image = self.prepare(name, size, width)
+            with self.lock:
+                image = self.images.setdefault(key, image)
+        return image
+
+    def manifest(self):
+        """Returns the (name, size, width) of every asset listed in the manifest."""
+        try:
+            with open(os.path.join(self.asset_path, self.manifest_name)) as file:
+                return [(entry['name'], entry['size'], entry.get('width', entry['size'])) for entry in json.load(file)]
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def preload(self):
+        """Prepares every asset in the manifest on a background thread."""
+        if self.preload_thread is not None:
+            return
+        self.preload_thread = threading.Thread(
+            target=lambda: [self.get(*entry) for entry in self.manifest()],
+            daemon=True)
+        self.preload_thread.start()
 
 
 class ResourceManager:
     """Class that manages resources and UI assets. It handles:
-    - lazy loading of image assets at different sizes,
+    - loading of image assets at different sizes from a shared, preloaded atlas,
     - manages the current zoom level of the map image,
     - manages the context and lifetime of UI assets."""
     def __init__(self, path, default_size=None):
         self.resources = dict()
         self.asset_path = path
         self.default_size = default_size
+        self.atlas = AssetAtlas.shared(path)
+        self.atlas.preload()
 
     def load(self, name, size=None, width=None):
         """Loads an image asset and returns a PhotoImage object"""
@@ -65,20 +174,189 @@ class ResourceManager:
         if width is None:
             width = size
         if (name, size, width) not in self.resources:
-            image = Image.open(f"{self.asset_path}/{name}.png")
-            if size is not None:
-                image = image.resize((size if width is None else width, size), Image.Resampling.LANCZOS)
-            photo = ImageTk.PhotoImage(image)
+            photo = ImageTk.PhotoImage(self.atlas.get(name, size, width))
             self.resources[(name, size, width)] = photo
         else:
             photo = self.resources[(name, size, width)]
         return photo
 
+
+class TilePyramid:
+    """Multi-resolution tiled copy of a map image, built once per map.
+    Level 0 is the map at its fitted size (zoom 1.0), each level up doubles the resolution until the
+    source image resolution is reached, and two levels below halve it for zooming out.
+    Every level is cut into square tiles, so a view is assembled from only the tiles it covers at the
+    nearest level at or above the zoom, and the cost of a view is fixed by the view size alone."""
+    tile_size = 256
+    lowest_level = -2
+
+    def __init__(self, source, base_size):
+        self.base_width, self.base_height = base_size
+        # Palette, greyscale and other modes cannot be resampled or pasted into new images as they are
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA')
+        self.mode = source.mode
+        self.scales = []
+        self.level_sizes = []
+        self.tiles = dict()
+        sizes = []
+        level = self.lowest_level
+        while True:
+            scale = 2.0 ** level
+            if level > 0 and self.base_width * scale >= source.width:
+                # The top level is the source image itself
+                scale = source.width / self.base_width
+            sizes.append((max(1, round(self.base_width * scale)), max(1, round(self.base_height * scale))))
+            if level >= 0 and sizes[-1][0] >= source.width:
+                break
+            level += 1
+        # Each level is resized from the one above it, so the pyramid costs little more than its top level
+        level_images = [source if sizes[-1] == source.size else source.resize(sizes[-1], Image.Resampling.LANCZOS)]
+        for size in reversed(sizes[:-1]):
+            level_images.append(level_images[-1].resize(size, Image.Resampling.LANCZOS))
+        for level_image in reversed(level_images):
+            self.add_level(level_image)
+
+    def add_level(self, level_image):
+        """Cuts a level image into tiles."""
+        level = len(self.scales)
+        self.scales.append(level_image.width / self.base_width)
+        self.level_sizes.append(level_image.size)
+        for y in range(0, level_image.height, self.tile_size):
+            for x in range(0, level_image.width, self.tile_size):
+                tile = level_image.crop((x, y, min(x + self.tile_size, level_image.width),
+                                         min(y + self.tile_size, level_image.height)))
+                self.tiles[(level, x // self.tile_size, y // self.tile_size)] = tile
+
+    def nearest_level(self, zoom):
+        """Returns the lowest level with at least the resolution of the zoom, or the top level."""
+        for level, scale in enumerate(self.scales):
+            if scale >= zoom * 0.999:
+                return level
+        return len(self.scales) - 1
+
+    def assemble(self, level, box):
+        """Pastes together the tiles covering an integer box of a level, outside the level is left blank."""
+        x0, y0, x1, y1 = box
+        region = Image.new(self.mode, (x1 - x0, y1 - y0))
+        level_width, level_height = self.level_sizes[level]
+        first_x, first_y = max(x0, 0) // self.tile_size, max(y0, 0) // self.tile_size
+        last_x = (min(x1, level_width) - 1) // self.tile_size
+        last_y = (min(y1, level_height) - 1) // self.tile_size
+        for ty in range(first_y, last_y + 1):
+            for tx in range(first_x, last_x + 1):
+                region.paste(self.tiles[(level, tx, ty)], (tx * self.tile_size - x0, ty * self.tile_size - y0))
+        return region
+
+    def render(self, zoom, position, size):
+        """Returns the view of the map at a zoom level as a PIL image,
+        position is the top left of the view in zoomed map pixels."""
+        width, height = size
+        view = Image.new(self.mode, (width, height))
+        # Only the part of the view covered by the map is drawn, the rest is left blank
+        x0, y0 = max(0, math.ceil(-position[0])), max(0, math.ceil(-position[1]))
+        x1 = min(width, math.floor(int(self.base_width * zoom) - position[0]))
+        y1 = min(height, math.floor(int(self.base_height * zoom) - position[1]))
+        if x1 <= x0 or y1 <= y0:
+            return view
+        level = self.nearest_level(zoom)
+        factor = self.scales[level] / zoom
+        # The visible map in level pixels, widened to whole pixels for the tile lookup
+        left, top = (position[0] + x0) * factor, (position[1] + y0) * factor
+        right, bottom = (position[0] + x1) * factor, (position[1] + y1) * factor
+        box = (math.floor(left), math.floor(top), math.ceil(right), math.ceil(bottom))
+        region = self.assemble(level, box)
+        if region.size != (x1 - x0, y1 - y0) or (left, top) != box[:2]:
+            region = region.resize((x1 - x0, y1 - y0), Image.Resampling.LANCZOS,
+                                   box=(left - box[0], top - box[1], right - box[0], bottom - box[1]))
+        view.paste(region, (x0, y0))
+        return view
+
+
+class ZoomCache:
+    """Memory budgeted LRU cache of whole map images keyed by zoom level.
+    Zoom levels are rendered from a tile pyramid on a background thread, so the levels either side of
+    the current zoom can be prefetched while the user is looking at the map."""
+    zoom_precision = 6
+
+    def __init__(self, pyramid, memory_budget=64 * 2 ** 20):
+        self.pyramid = pyramid
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.images = OrderedDict()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def key(self, zoom):
+        return round(zoom, self.zoom_precision)
+
+    def zoom_size(self, zoom):
+        return int(self.pyramid.base_width * zoom), int(self.pyramid.base_height * zoom)
+
+    def image_bytes(self, size):
+        return size[0] * size[1] * len(self.pyramid.mode)
+
+    def get(self, zoom):
+        """Returns the whole map image at a zoom level if it is cached, otherwise returns None."""
+        with self.lock:
+            image = self.images.get(self.key(zoom))
+            if image is not None:
+                self.images.move_to_end(self.key(zoom))
+            return image
+
+    def put(self, zoom, image):
+        """Caches a map image, evicting the least recently used zoom levels to stay within the memory budget."""
+        size = self.image_bytes(image.size)
+        if size > self.memory_budget:
+            return
+        with self.lock:
+            if self.key(zoom) in self.images:
+                return
+            while self.images and self.memory_used + size > self.memory_budget:
+                _, evicted = self.images.popitem(last=False)
+                self.memory_used -= self.image_bytes(evicted.size)
+            self.images[self.key(zoom)] = image
+            self.memory_used += size
+
+    def render(self, zoom):
+        try:
+            self.put(zoom, self.pyramid.render(zoom, (0, 0), self.zoom_size(zoom)))
+        finally:
+            with self.lock:
+                self.pending.discard(self.key(zoom))
+
+    def prefetch(self, zooms):
+        """Renders zoom levels that are not cached yet on the background thread."""
+        for zoom in zooms:
+            key = self.key(zoom)
+            if self.image_bytes(self.zoom_size(zoom)) > self.memory_budget:
+                continue
+            with self.lock:
+                if key in self.images or key in self.pending:
+                    continue
+                self.pending.add(key)
+            self.executor.submit(self.render, zoom)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
 class MapImageManager:
+    """Renders the visible map from its tile pyramid.
+    The rendered image is a buffer reaching pan_margin pixels past each side of the view, so small pans
+    only move the image on the canvas and it is only re-rendered when the view leaves it or the zoom changes."""
+    pan_margin = 120
+    zoom_step = 1.2
+
     def __init__(self):
         self.original_map = None
+        self.pyramid = None
+        self.zoom_cache = None
         self.current_map = None
         self.map_zoom = 1.0
+        self.buffer_origin = None
+        self.buffer_view_size = None
 
     def load_map(self, map_name, dimensions):
         """Loads an image asset and returns a PhotoImage object"""
@@ -93,29 +371,53 @@ class MapImageManager:
             new_width = target_width
             new_height = int(target_width / aspect_ratio)
         self.original_map = map_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        self.pyramid = TilePyramid(map_image, (new_width, new_height))
+        if self.zoom_cache is not None:
+            self.zoom_cache.close()
+        self.zoom_cache = ZoomCache(self.pyramid)
         map_image = ImageTk.PhotoImage(map_image)
         map_scale = new_height / original_height
         self.map_zoom = 1.0
         self.current_map = map_image
+        self.buffer_origin = None
         return map_image, map_scale
 
+    def buffer_covers(self, zoom, position, size):
+        """Checks if the rendered buffer is at this zoom and contains the whole view."""
+        if self.buffer_origin is None or zoom != self.map_zoom or size != self.buffer_view_size:
+            return False
+        return all(0 <= p - o <= 2 * self.pan_margin for p, o in zip(position, self.buffer_origin))
+
     def map_update(self, zoom, position, size):
-        """Updates the map image when moved or zoomed and returns a PhotoImage object."""
-        self.map_zoom = zoom
+        """Updates the map image when moved or zoomed.
+        Returns a PhotoImage object, the view position and the offset of the image from the view's top left."""
         new_width = int(self.original_map.width * zoom)
         new_height = int(self.original_map.height * zoom)
-        new_map_image = self.original_map.resize((new_width, new_height), Image.Resampling.LANCZOS)
-        width, height = size
         x0, y0 = position
-        if x0 > new_map_image.width - 30:
-            x0 = new_map_image.width - 30
-        if y0 > new_map_image.height - 30:
-            y0 = new_map_image.height - 30
+        if x0 > new_width - 30:
+            x0 = new_width - 30
+        if y0 > new_height - 30:
+            y0 = new_height - 30
         position = [x0, y0]
-        x1 = x0 + width
-        y1 = y0 + height
-        cropped_image = new_map_image.crop((x0, y0, x1, y1))
-        map_image = ImageTk.PhotoImage(cropped_image)
-        self.current_map = map_image
-        return map_image, position
+        if not self.buffer_covers(zoom, position, size):
+            self.map_zoom = zoom
+            self.buffer_origin = (x0 - self.pan_margin, y0 - self.pan_margin)
+            self.buffer_view_size = size
+            buffer_size = tuple(x + 2 * self.pan_margin for x in size)
+            # Crop the buffer from the cached zoom level if it is ready, and prefetch this zoom and its neighbours
+            zoomed_map = self.zoom_cache.get(zoom)
+            if zoomed_map is not None:
+                x, y = (round(x) for x in self.buffer_origin)
+                self.buffer_origin = (x, y)
+                buffer_image = zoomed_map.crop((x, y, x + buffer_size[0], y + buffer_size[1]))
+            else:
+                buffer_image = self.pyramid.render(zoom, self.buffer_origin, buffer_size)
+            self.current_map = ImageTk.PhotoImage(buffer_image)
+            self.zoom_cache.prefetch([zoom, zoom * self.zoom_step, zoom / self.zoom_step])
+        offset = (self.buffer_origin[0] - x0, self.buffer_origin[1] - y0)
+        return self.current_map, position, offset
 
+    def close(self):
+        """Stops any background rendering."""
+        if self.zoom_cache is not None:
+            self.zoom_cache.close()
@@ -4,10 +4,12 @@
 
 # Uses TkInter UI to demo a proper native mobile interface
 
+import time
 import tkinter as tk
 
-from FuzzyNameSearch import find_best_match
-from RFO_File import load_rfo
+from FuzzyNameSearch import SearchSession
+from MapCache import load_map
+from RouteTable import load_route_table, route_table_filename
 from ResourceManager import ResourceManager, ContextManager, MapImageManager
 
 
@@ -30,7 +32,9 @@ class RouteFinder:
             self.username = username
 
         # Load data from sql file
-        version, map_filename, self.rfo_scale, self.rfo_units, self.network = load_rfo("maps/" + rfo_filename)
+        version, map_filename, self.rfo_scale, self.rfo_units, self.network = load_map("maps/" + rfo_filename)
+        self.network.route_table = load_route_table(route_table_filename("maps/" + rfo_filename), self.network)
+        self.search_session = SearchSession(self.network.name_index())
 
         # Resource Manager
         self.resources = ResourceManager(path="ui_components", default_size=50)
@@ -52,7 +56,14 @@ class RouteFinder:
         self.canvas = tk.Canvas(root, width=self.frame[0], height=self.frame[1], bg="gray")
         self.canvas.place(x=0, y=0, anchor=tk.NW)
         self.canvas.grid(row=0, column=0, sticky="nsew")
-        self.canvas.bind("<Configure>", self.update_display)
+        self.canvas.bind("<Configure>", self.request_redraw)
+
+        # Redraw scheduling, input events request a redraw and at most one is drawn per frame
+        self.frame_interval = 16
+        self.redraw_pending = None
+        self.last_redraw_time = 0.0
+        self.frames_rendered = 0
+        self.frames_dropped = 0
 
         # Ensure we close cleanly
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -68,6 +79,15 @@ class RouteFinder:
         self.map_zoom = 1.0
         self.map_position = [0, 0]
 
+        # The map image reaches past the view while panning, so cover the canvas around the view
+        view_right, view_bottom = self.map_offset[0] + self.map_size[0], self.map_offset[1] + self.map_size[1]
+        self.map_masks = [
+            self.canvas.create_rectangle(box, fill="gray", outline="")
+            for box in [(0, 0, self.frame[0], self.map_offset[1]),
+                        (0, view_bottom, self.frame[0], self.frame[1]),
+                        (0, 0, self.map_offset[0], self.frame[1]),
+                        (view_right, 0, self.frame[0], self.frame[1])]]
+
         # Frame overlay
         self.frame_image = self.resources.load("frame", self.frame[1], self.frame[0])
         self.fg_canvas = self.canvas.create_image(
@@ -82,7 +102,7 @@ class RouteFinder:
         self.root.bind("<KeyPress-=>", self.zoom_in_map)
         self.root.bind("<KeyPress-minus>", self.zoom_out_map)
         self.root.bind("<KeyPress-s>", self.start_mode)
-        self.canvas.bind("<Configure>", self.update_display)
+        self.canvas.bind("<Configure>", self.request_redraw)
 
         # List of recently selected locations
         if recents is None:
@@ -99,6 +119,10 @@ class RouteFinder:
         self.route_coordinates = []
         self.route_visible = False
         self.current_route_leg = -1
+        # The route leg the directions panel was built for, None when it needs rebuilding
+        self.directions_leg = None
+        self.route_layout = None
+        self.route_drawn_colors = None
 
         # Navigation arrow resource lookup
         self.direction_images = {
@@ -135,14 +159,20 @@ class RouteFinder:
             x, y, x + 20, y + 20,
             fill="blue",
             width=6,
-        )
+            tags=('route', 'route_line'))
             for x, y in self.route_coordinates]
         route_ovals = [self.canvas.create_oval(
             x, y, x + 20, y + 20,
             fill="orange",
             outline="",
-            width=1)
+            width=1,
+            tags=('route',))
                             for x, y in self.route_coordinates]
+        # The route is drawn on the map, under the frame overlay and the controls lifted above it
+        self.canvas.lower('route', self.fg_canvas)
+        # New route items have to be laid out and coloured in full on the next update
+        self.route_layout = None
+        self.route_drawn_colors = None
         self.components.manage_context(
             tag='route_lines',
             asset=route_lines,
@@ -195,13 +225,19 @@ class RouteFinder:
         self.current_route_leg = -1
         self.route_visible = False
         self.components.switch_context('route_off')
+        self.directions_leg = None
         self.route = []
         self.route_coordinates = []
 
+    def switch_mode(self):
+        """Remove the UI elements of the current mode, including the directions panel."""
+        self.components.switch_context('mode')
+        self.directions_leg = None
+
     def map_mode(self, _event=None):
         """Plain map view mode."""
         self.mode = "map"
-        self.components.switch_context('mode')
+        self.switch_mode()
         self.route_off()
         self.add_button(
             tag="Screen 1/Foreground",
@@ -233,7 +269,7 @@ class RouteFinder:
     def start_mode(self, _event=None):
         """Enter a location to start navigating from."""
         self.mode = "start"
-        self.components.switch_context('mode')
+        self.switch_mode()
         self.route_off()
         self.root.unbind("<KeyPress-s>")
         self.add_button(
@@ -322,7 +358,7 @@ class RouteFinder:
     def location_mode(self, _event=None):
         """Display the selected location in the centre of the map."""
         self.mode = "location"
-        self.components.switch_context('mode')
+        self.switch_mode()
         self.add_button(
             tag="Screen 5/Foreground",
             image=self.resources.load("Screen 5/Foreground", 203, 408),
@@ -362,7 +398,7 @@ class RouteFinder:
     def start_change_mode(self, _event=None):
         """Change the start location for navigation."""
         self.mode = "start_change"
-        self.components.switch_context('mode')
+        self.switch_mode()
         self.root.unbind("<KeyPress-s>")
         self.add_button(
             tag="Screen 2/Foreground",
@@ -450,7 +486,7 @@ class RouteFinder:
     def destination_mode(self, _event=None):
         """Enter a destination location to navigate to."""
         self.mode = "destination"
-        self.components.switch_context('mode')
+        self.switch_mode()
         self.root.unbind("<KeyPress-s>")
         self.add_button(
             tag="Screen 2/Foreground",
@@ -538,7 +574,7 @@ class RouteFinder:
     def route_summary_mode(self, _event=None):
         """Summarize the route"""
         self.mode = "route_summary"
-        self.components.switch_context('mode')
+        self.switch_mode()
         self.add_button(
             tag="Screen 3/Foreground",
             image=self.resources.load("Screen 3/Foreground", 394, 408),
@@ -623,7 +659,7 @@ class RouteFinder:
     def navigate_mode(self, _event=None):
         """Navigate the best route from start to destination."""
         self.mode = "navigate"
-        self.components.switch_context('mode')
+        self.switch_mode()
         self.route_off()
         self.route = self.network.find_best_route(
             self.network.names.index(self.route_start_name),
@@ -673,17 +709,17 @@ class RouteFinder:
             self.map_position[0] = self.map_position[0] - dx
             self.map_position[1] = self.map_position[1] - dy
 
-            self.update_display()
+            self.request_redraw()
 
     def zoom_in_map(self, _event=None):
         """Zoom in by increasing the zoom level and updating the display."""
         self.map_zoom *= 1.2  # Increase zoom level by 20%
-        self.update_display()
+        self.request_redraw()
 
     def zoom_out_map(self, _event=None):
         """Zoom out by decreasing the zoom level and updating the display."""
         self.map_zoom /= 1.2  # Decrease zoom level by 20%
-        self.update_display()
+        self.request_redraw()
 
     def next_leg(self, _event=None):
         """Move to the next leg of the route"""
@@ -691,7 +727,7 @@ class RouteFinder:
             if self.current_route_leg < len(self.route) - 1:
                 self.current_route_leg += 1
             self.move_to(self.route_coordinates[self.current_route_leg])
-            self.update_display()
+            self.request_redraw()
 
     def prev_leg(self, _event=None):
         """Move to the previous leg of the route"""
@@ -699,51 +735,99 @@ class RouteFinder:
             if self.current_route_leg > -1:
                 self.current_route_leg -= 1
             self.move_to(self.route_coordinates[self.current_route_leg])
-            self.update_display()
+            self.request_redraw()
 
     def move_to(self, location):
         """Move the given location to the centre of the screen."""
         self.map_position = [x * self.map_zoom - o // 2 for x, o in zip(location, self.map_size)]
 
 
+    def request_redraw(self, _event=None):
+        """Marks the view as needing a redraw, requests made before the next frame is drawn are coalesced."""
+        if self.redraw_pending is not None:
+            self.frames_dropped += 1
+            return
+        elapsed = int((time.perf_counter() - self.last_redraw_time) * 1000)
+        self.redraw_pending = self.root.after(max(0, self.frame_interval - elapsed), self.redraw)
+
+    def redraw(self):
+        """Draws a frame requested by request_redraw."""
+        self.redraw_pending = None
+        self.last_redraw_time = time.perf_counter()
+        self.frames_rendered += 1
+        self.update_display()
+
+    def cancel_redraw(self):
+        if self.redraw_pending is not None:
+            self.root.after_cancel(self.redraw_pending)
+            self.redraw_pending = None
+
+    def route_colors(self):
+        """Returns the fill colours of the route ovals and lines for the current leg."""
+        last = len(self.route) - 1
+        oval_colors = ["#a3ced9" if i == last else
+                       "#e04040" if i == self.current_route_leg else
+                       "#4274ba" for i in range(len(self.route_coordinates))]
+        line_colors = ["#404040" if i == last else
+                       "#e04040" if i == self.current_route_leg else
+                       "#4274ba" for i in range(len(self.route_coordinates))]
+        return oval_colors + line_colors
+
+    def update_route_overlay(self):
+        """Moves and recolours the route to match the map.
+        Pans move every route item with one canvas move, zooms scale the lines with one canvas scale and
+        recentre the fixed-size ovals, and only items whose colour has changed are recoloured."""
+        route_ovals = self.components.get_asset('route_ovals')
+        route_lines = self.components.get_asset('route_lines')
+        if self.route_layout is None:
+            points = [self.map_point_to_screen_point(node) for node in self.route_coordinates]
+            for node_index, (x, y) in enumerate(points):
+                self.canvas.coords(route_ovals[node_index],
+                                   x - self.node_size // 2, y - self.node_size // 2,
+                                   x + self.node_size // 2, y + self.node_size // 2)
+                end_x, end_y = points[min(node_index + 1, len(points) - 1)]
+                self.canvas.coords(route_lines[node_index], x, y, end_x, end_y)
+        else:
+            zoom, position = self.route_layout
+            if zoom != self.map_zoom:
+                # Scale about the screen origin, then shift to the new view position
+                factor = self.map_zoom / zoom
+                self.canvas.scale('route_line', 0, 0, factor, factor)
+                self.canvas.move('route_line',
+                                 factor * (position[0] - self.map_offset[0]) - self.map_position[0] + self.map_offset[0],
+                                 factor * (position[1] - self.map_offset[1]) - self.map_position[1] + self.map_offset[1])
+                for node_index, node in enumerate(self.route_coordinates):
+                    x, y = self.map_point_to_screen_point(node)
+                    self.canvas.coords(route_ovals[node_index],
+                                       x - self.node_size // 2, y - self.node_size // 2,
+                                       x + self.node_size // 2, y + self.node_size // 2)
+            elif position != self.map_position:
+                self.canvas.move('route', position[0] - self.map_position[0], position[1] - self.map_position[1])
+        self.route_layout = self.map_zoom, list(self.map_position)
+
+        colors = self.route_colors()
+        for index, (item, color) in enumerate(zip(route_ovals + route_lines, colors)):
+            if self.route_drawn_colors is None or self.route_drawn_colors[index] != color:
+                self.canvas.itemconfig(item, fill=color)
+        self.route_drawn_colors = colors
+
     def update_display(self, _event=None):
         """Update all active UI elements."""
         # Update the visible section of the map
-        map_image, self.map_position = self.scalemap.map_update(self.map_zoom, self.map_position, self.map_size)
-        self.canvas.itemconfig(self.map_canvas, image=map_image)
-        self.canvas.coords(self.map_canvas, self.map_offset[0], self.map_offset[1])
+        # Panning within the rendered buffer only moves the map image
+        map_image, self.map_position, image_offset = self.scalemap.map_update(
+            self.map_zoom, self.map_position, self.map_size)
+        if map_image is not self.current_map_image:
+            self.current_map_image = map_image
+            self.canvas.itemconfig(self.map_canvas, image=map_image)
+        self.canvas.coords(self.map_canvas, self.map_offset[0] + image_offset[0], self.map_offset[1] + image_offset[1])
 
         # If the route is visible, draw the route
         if self.route_visible:
-            route_ovals = self.components.get_asset('route_ovals')
-            for node_index, node in enumerate(self.route_coordinates):
-                highlight = (node_index == self.current_route_leg) or len(self.route) == 1
-                start = [x - self.node_size // 2 for x in self.map_point_to_screen_point(node)]
-                end = [x + self.node_size // 2 for x in self.map_point_to_screen_point(node)]
-                self.canvas.coords(route_ovals[node_index], start + end)
-                node_color = "#4274ba"
-                if highlight:
-                    node_color = "#e04040"
-                if node_index == len(self.route) - 1:
-                    node_color = "#a3ced9"
-                self.canvas.itemconfig(route_ovals[node_index], fill=node_color)
-            route_lines = self.components.get_asset('route_lines')
-            for route_index, route_leg in enumerate(self.route_coordinates):
-                start_point = self.map_point_to_screen_point(route_leg)
-                if route_index == len(self.route) - 1:
-                    end_point = [start_point[0], start_point[1]]
-                    leg_color = "#404040"
-                else:
-                    end_point = self.map_point_to_screen_point(self.route_coordinates[route_index + 1])
-                    if route_index == self.current_route_leg:
-                        leg_color = "#e04040"
-                    else:
-                        leg_color = "#4274ba"
-                self.canvas.coords(route_lines[route_index], start_point[0], start_point[1], end_point[0], end_point[1])
-                self.canvas.itemconfig(route_lines[route_index], fill=leg_color)
-
-            # Give directions
-            if self.route_visible and len(self.route) > 1:
+            self.update_route_overlay()
+
+            # Give directions, the panel is only rebuilt when the leg changes or a mode switch has removed it
+            if self.route_visible and len(self.route) > 1 and self.directions_leg != self.current_route_leg:
                 self.components.switch_context('navigate')
                 dir_prev, instr, dist, to_loc, dir_next = self.get_directions()
                 prev_arrow = None
@@ -790,9 +874,9 @@ class RouteFinder:
                 self.canvas.itemconfig(instruction_text_object, text=to_loc)
                 distance_text_object = self.components.get_asset('distance_text_object')
                 self.canvas.itemconfig(distance_text_object, text=dist)
+                self.directions_leg = self.current_route_leg
 
-        # Reorder the active control elements
-        self.canvas.lift(self.fg_canvas)
+        # Reorder the active control elements above the frame overlay
         self.components.reorder_assets(lambda x: self.canvas.lift(x) if type(x) is int else None)
 
     def get_directions(self):
@@ -849,7 +933,7 @@ class RouteFinder:
         self.components.switch_context('typing')
         entry = self.components.get_asset('entry')
         text = entry.get().lower()
-        matches = find_best_match(text, self.network.names, 5)
+        matches = self.search_session.find_best_match(text, 5)
         list_box = self.components.get_asset('listbox')
         list_box.delete(0, tk.END)
         for match in matches[:5]:
@@ -879,6 +963,8 @@ class RouteFinder:
     def logout(self, event=None):
         self.components.switch_context('all')
         self.save_history()
+        self.cancel_redraw()
+        self.scalemap.close()
         geometry = self.root.geometry()
         self.root.destroy()
         self.root = None
@@ -890,6 +976,8 @@ class RouteFinder:
     def on_closing(self):
         """Handle the window closing event."""
         self.save_history()
+        self.cancel_redraw()
+        self.scalemap.close()
         self.root.destroy()
         self.root = None
 
@@ -0,0 +1,86 @@
+# Route Finder Mobile
+# RouteTable.py
+# 16 October 2026
+
+# Precomputed all-pairs next-hop table for a Network
+# next_hops[start * N + end] is the node to move to from start on the best route to end
+# (-1 if end cannot be reached), so a route is read off in O(path length) with no search
+
+# The table is built once per map by running Dijkstra from every node over the CSR connections,
+# and is saved next to the .rfo file as a '.routes' file:
+#   a single text header line:
+#       # Route Finder Route Table <version> <node count> <connection fingerprint>
+#   followed by the N x N next-hop table as native 32-bit integers
+# The fingerprint is a hash of the connections, so a table is ignored once the map has been edited
+
+# Build a table for a map with:
+#   python RouteTable.py maps/2023-SS-Campus-Map.rfo
+
+import hashlib
+import sys
+from array import array
+
+from AStar import dijkstra, NO_PARENT
+
+VERSION_CODE = "2025a"
+RFO_EXTENSION = '.rfo'
+ROUTE_TABLE_EXTENSION = '.routes'
+
+
+def route_table_filename(rfo_filename):
+    if rfo_filename.endswith(RFO_EXTENSION):
+        rfo_filename = rfo_filename[:-len(RFO_EXTENSION)]
+    return rfo_filename + ROUTE_TABLE_EXTENSION
+
+
+def connection_fingerprint(network):
+    digest = hashlib.sha1()
+    digest.update(array('q', network.edge_offsets).tobytes())
+    digest.update(array('q', network.edge_targets).tobytes())
+    digest.update(array('d', network.edge_weights).tobytes())
+    return digest.hexdigest()
+
+
+def build_route_table(network):
+    node_count = len(network.names)
+    next_hops = array('i', [NO_PARENT]) * (node_count * node_count)
+    for start in range(node_count):
+        cost, parent = dijkstra(node_count, network.edges_from, start)
+        row = start * node_count
+        next_hops[row + start] = start
+        # Nodes in order of cost have their parent's next hop already filled in
+        for end in sorted(range(node_count), key=lambda x: cost[x]):
+            if parent[end] == start:
+                next_hops[row + end] = end
+            elif parent[end] != NO_PARENT:
+                next_hops[row + end] = next_hops[row + parent[end]]
+    return next_hops
+
+
+def save_route_table(filename, network, next_hops):
+    with open(filename, 'wb') as file:
+        header = f"# Route Finder Route Table {VERSION_CODE} {len(network.names)} {connection_fingerprint(network)}\n"
+        file.write(header.encode())
+        next_hops.tofile(file)
+
+
+def load_route_table(filename, network):
+    node_count = len(network.names)
+    try:
+        with open(filename, 'rb') as file:
+            header = file.readline().decode().split()
+            if header[-3:] != [VERSION_CODE, str(node_count), connection_fingerprint(network)]:
+                return None
+            next_hops = array('i')
+            next_hops.fromfile(file, node_count * node_count)
+            return next_hops
+    except (OSError, EOFError, UnicodeDecodeError):
+        return None
+
+
+if __name__ == "__main__":
+    from RFO_File import load_rfo
+
+    for rfo_filename in sys.argv[1:]:
+        version, map_filename, scale, units, rfo_network = load_rfo(rfo_filename)
+        save_route_table(route_table_filename(rfo_filename), rfo_network, build_route_table(rfo_network))
@@ -0,0 +1,108 @@
+# Route Finder Mobile
+# SpatialIndex.py
+# 17 October 2026
+
+# Uniform grid index over a set of 2D points for hit-testing and proximity queries
+# The bounding box of the points is divided into square cells sized to hold about points_per_cell
+# points each, and the point indexes are stored grouped by cell in CSR form (as for Network connections):
+#   cell_offsets - the points in cell c are cell_points[cell_offsets[c]:cell_offsets[c + 1]]
+#   cell_points - point indexes sorted by cell, cells numbered row by row
+# so a query only visits the cells overlapping its search area, one slice per grid row, and its cost
+# depends on the number of points near the query rather than the total
+
+# Important methods
+#   nearest - the closest point to a location, optionally within a maximum distance
+#   within_radius - every point within a distance of a location, nearest first
+#   in_rect - every point inside an (x, y, width, height) rectangle, edges included
+
+import math
+
+import numpy as np
+
+
+class SpatialIndex:
+    points_per_cell = 2
+
+    def __init__(self, points):
+        # points - N x 2 array of point coordinates, point indexes are its row numbers
+        self.points = np.asarray(points, dtype=np.float64)
+        count = len(self.points)
+        if count:
+            self.origin = self.points.min(axis=0)
+            extent = self.points.max(axis=0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+        # Square cells for points spread over an area, and cells along the longer side for points on a line
+        self.cell_size = max(math.sqrt(extent[0] * extent[1] * self.points_per_cell / max(count, 1)),
+                             float(extent.max()) * self.points_per_cell / max(count, 1),
+                             1e-9)
+        self.columns = int(extent[0] // self.cell_size) + 1
+        self.rows = int(extent[1] // self.cell_size) + 1
+        columns, rows = self.cell_range(self.points)
+        cells = rows * self.columns + columns
+        self.cell_points = np.argsort(cells, kind='stable')
+        self.cell_offsets = np.searchsorted(cells[self.cell_points], np.arange(self.columns * self.rows + 1))
+
+    def cell_range(self, coordinates):
+        """Returns the (column, row) arrays of the cells containing coordinates, clamped to the grid."""
+        cell = np.floor((np.asarray(coordinates, dtype=np.float64) - self.origin) / self.cell_size)
+        cell = cell.reshape(-1, 2)
+        columns = np.clip(cell[:, 0], 0, self.columns - 1).astype(np.intp)
+        rows = np.clip(cell[:, 1], 0, self.rows - 1).astype(np.intp)
+        return columns, rows
+
+    def candidates(self, x0, y0, x1, y1):
+        """Returns the indexes of the points in every cell overlapping a box."""
+        (first_column, last_column), (first_row, last_row) = self.cell_range([(x0, y0), (x1, y1)])
+        slices = [self.cell_points[self.cell_offsets[row * self.columns + first_column]:
+                                   self.cell_offsets[row * self.columns + last_column + 1]]
+                  for row in range(first_row, last_row + 1)]
+        return np.concatenate(slices) if slices else np.empty(0, dtype=np.intp)
+
+    def distances(self, location, indexes):
+        offsets = self.points[indexes] - np.asarray(location, dtype=np.float64)
+        return np.hypot(offsets[:, 0], offsets[:, 1])
+
+    def within_radius(self, location, radius):
+        """Returns the indexes of the points within radius of location, nearest first."""
+        x, y = location
+        indexes = self.candidates(x - radius, y - radius, x + radius, y + radius)
+        distances = self.distances(location, indexes)
+        inside = distances <= radius
+        indexes, distances = indexes[inside], distances[inside]
+        return [int(i) for i in indexes[np.lexsort((indexes, distances))]]
+
+    def in_rect(self, rect):
+        """Returns the indexes of the points inside an (x, y, width, height) rectangle in index order."""
+        x, y, width, height = rect
+        indexes = self.candidates(x, y, x + width, y + height)
+        points = self.points[indexes]
+        inside = (x <= points[:, 0]) & (points[:, 0] <= x + width) & \
+                 (y <= points[:, 1]) & (points[:, 1] <= y + height)
+        return sorted(int(i) for i in indexes[inside])
+
+    def nearest(self, location, max_distance=None):
+        """Returns the index of the point nearest to location (the lowest index of equally near points),
+        or None if there are no points within max_distance."""
+        if len(self.points) == 0:
+            return None
+        x, y = location
+        # Search squares of doubling size until one holds a point no further away than the square's half-width,
+        # as every point outside the square is further away than that
+        reach = self.cell_size
+        while True:
+            if max_distance is not None:
+                reach = min(reach, max_distance)
+            indexes = self.candidates(x - reach, y - reach, x + reach, y + reach)
+            if len(indexes):
+                distances = self.distances(location, indexes)
+                best = np.lexsort((indexes, distances))[0]
+                covers_all = len(indexes) == len(self.points)
+                if distances[best] <= reach or covers_all:
+                    if max_distance is not None and distances[best] > max_distance:
+                        return None
+                    return int(indexes[best])
+            if max_distance is not None and reach >= max_distance:
+                return None
+            reach *= 2
@@ -10,56 +10,122 @@
 # It can be used as a heuristic distance for route-finding algorithms
 # https://en.wikipedia.org/wiki/Force-directed_graph_drawing
 
-import time
-
-import pygame
-
-from sqlite_File import load_sql, save_sql
-from SpringPhysics import update
-
-FILE_NAME = "2023-SS-Campus-Map.sqlite"
-
-# Load the network file and add velocities
-version, map_filename, scale, units, network = load_sql(FILE_NAME)
-nodes: int = len(network.heuristics)
-original_locations = network.locations
-network.locations = [x for x in network.heuristics]
-network.velocities = None
-
-# How long before we stop updating the physics
-spring_adjust_time = 20
-
-# Initialize window
-pygame.init()
-canvas = pygame.display.set_mode([500, 500])
-pygame.display.set_caption(title="Spring Map")
-
-loop_exit = False
-cycle_timer = time.time()
-elapsed_timer = time.time()
-while not loop_exit:
-
-    # USER INTERACTIONS
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            loop_exit = True
-
-    # PHYSICS UPDATE FOR HEURISTIC SPRING MAP
-    if time.time() - elapsed_timer < spring_adjust_time:
-        time_step = time.time() - cycle_timer
-        cycle_timer = time.time()
-
-        network.locations, network.velocities = update(network.locations,
-                                                       network.velocities,
-                                                       network.connections,
-                                                       time_step)
-
-    # RENDER
-    canvas.fill('Black')
-    network.draw(canvas, weighted_edges=True, recenter_rect=[0, 0, 500, 500])
-    pygame.display.flip()
-
-# On Exit Save back to the RFO file
-network.heuristics = [x for x in network.locations]
-network.locations = original_locations
-save_sql(FILE_NAME, scale, units, network, map_filename)
+# Runs headless for unattended map builds:
+#   loads a .sqlite or .rfo map and starts the spring simulation from its heuristic locations
+#   (or from the node locations with --restart)
+#   integrates with a fixed time step until the kinetic energy per node falls below the tolerance
+#   on large maps, uses the Barnes-Hut repulsion until the energy stops falling, then finishes with exact
+#   steps, as the approximation alone never comes to rest (see SpringPhysics.py)
+#   writes the heuristic locations back to the map file, or to --output
+#   exits with status 2 if the layout is not at rest after --max-steps
+# The result depends only on the map and the options, not on the speed of the machine
+
+# Usage, from the repository folder so Network.py and RFO_File.py can be imported:
+#   PYTHONPATH=. python "Spring Algorithm/HeuristicDistances.py" maps/2023-SS-Campus-Map.rfo
+
+import argparse
+import math
+import os
+import sqlite3
+import sys
+
+from RFO_File import load_rfo, save_rfo, valid_versions
+from sqlite_File import load_sql, save_sql, SQLITE_EXTENSION
+from SpringPhysics import spring_edges, update_arrays
+
+# The default map is the one alongside this script, wherever it is run from
+FILE_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "2023-SS-Campus-Map.sqlite")
+TIME_STEP = 0.02
+DAMPING = 0.5
+TOLERANCE = 1e-6
+MAX_STEPS = 100000
+# Maps with more nodes than this start with the Barnes-Hut repulsion unless theta is given
+EXACT_NODE_LIMIT = 2000
+THETA = 0.5
+# Barnes-Hut steps end when the lowest energy in a window of PLATEAU_STEPS steps is within PLATEAU_CHANGE
+# (relative) of that of the window before
+PLATEAU_STEPS = 250
+PLATEAU_CHANGE = 0.05
+
+
+def load_map_file(filename):
+    if filename.endswith(SQLITE_EXTENSION):
+        return load_sql(filename)
+    return load_rfo(filename)
+
+
+def save_map_file(filename, version, map_filename, scale, units, network):
+    if filename.endswith(SQLITE_EXTENSION):
+        save_sql(filename, scale, units, network, map_filename)
+    elif version in valid_versions:
+        save_rfo(filename, scale, units, network, map_filename, version=version)
+    else:
+        save_rfo(filename, scale, units, network, map_filename)
+
+
+def generate_heuristics(network, time_step=TIME_STEP, damping=DAMPING, tolerance=TOLERANCE,
+                        max_steps=MAX_STEPS, theta=None, restart=False):
+    """Runs the spring simulation until it comes to rest and returns (positions, steps, kinetic energy per node).
+    With theta > 0 the steps switch to exact repulsion once the energy stops falling."""
+    positions = network.location_array if restart else network.heuristic_array
+    if theta is None:
+        theta = 0.0 if len(positions) <= EXACT_NODE_LIMIT else THETA
+    edges = spring_edges(network.connections)
+    velocities = None
+    energy = 0.0
+    window_low = previous_low = math.inf
+    for step in range(1, max_steps + 1):
+        positions, velocities = update_arrays(positions, velocities, edges, time_step, theta, damping)
+        energy = 0.5 * float((velocities ** 2).sum()) / max(len(positions), 1)
+        if energy < tolerance:
+            return positions, step, energy
+        if theta > 0:
+            window_low = min(window_low, energy)
+            if step % PLATEAU_STEPS == 0:
+                if abs(window_low - previous_low) < PLATEAU_CHANGE * previous_low:
+                    theta = 0.0
+                previous_low, window_low = window_low, math.inf
+    return positions, max_steps, energy
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Generate heuristic locations for a Route Finder map")
+    parser.add_argument("filename", nargs="?", default=FILE_NAME, help="the .rfo or .sqlite map file")
+    parser.add_argument("--output", help="file to write the map to, by default the input file")
+    parser.add_argument("--time-step", type=float, default=TIME_STEP)
+    parser.add_argument("--damping", type=float, default=DAMPING)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="kinetic energy per node at which the layout is at rest")
+    parser.add_argument("--max-steps", type=int, default=MAX_STEPS)
+    parser.add_argument("--theta", type=float, default=None,
+                        help="Barnes-Hut opening ratio for the coarse layout, 0 for exact repulsion throughout")
+    parser.add_argument("--restart", action="store_true",
+                        help="start from the node locations instead of the current heuristics")
+    options = parser.parse_args(arguments)
+
+    # sqlite3.connect would create an empty database in place of a missing file
+    try:
+        data = load_map_file(options.filename) if os.path.isfile(options.filename) else None
+    except (OSError, sqlite3.Error):
+        data = None
+    if data is None:
+        print(f"Could not read {options.filename}", file=sys.stderr)
+        return 1
+    version, map_filename, scale, units, network = data
+    positions, steps, energy = generate_heuristics(network,
+                                                   time_step=options.time_step,
+                                                   damping=options.damping,
+                                                   tolerance=options.tolerance,
+                                                   max_steps=options.max_steps,
+                                                   theta=options.theta,
+                                                   restart=options.restart)
+    network.heuristics = positions
+    save_map_file(options.output or options.filename, version, map_filename, scale, units, network)
+    at_rest = energy < options.tolerance
+    state = "at rest" if at_rest else "not at rest"
+    print(f"{len(positions)} nodes {state} after {steps} steps, kinetic energy per node {energy:.3g}")
+    return 0 if at_rest else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
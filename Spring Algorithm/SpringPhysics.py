@@ -7,6 +7,22 @@
 
 # Simple model of a set of nodes, which repel each other connected by springs
 
+# The forces are computed with NumPy over N x 2 position and velocity arrays (see update_arrays):
+#   repulsion between every pair of nodes, either exactly in blocks of rows of the N x N distance matrix,
+#   or approximately with a Barnes-Hut quadtree (theta > 0) in O(N log N), where a distant cell of nodes
+#   acts as a single node of its total mass at its centre of mass
+#   spring forces along each connection, from (start, end, weight) edge arrays (see spring_edges)
+# update keeps the original list of Vector interface for existing callers
+
+# The quadtree is rebuilt every step, so as nodes move a cell can switch between the far approximation and
+# exact forces, a small jump in force that keeps adding energy. The layout never comes fully to rest with
+# theta > 0: use it for a coarse layout of large maps, then finish with exact steps once the energy stops
+# falling (see HeuristicDistances.generate_heuristics)
+# Each step on 5,000 nodes takes about 0.6 s exactly and 0.2-0.25 s with theta 0.5, and a layout needs
+# thousands of steps, so large maps take tens of minutes rather than seconds
+
+import numpy as np
+
 from Vector import Vector
 
 
@@ -15,33 +31,165 @@ repulsion_strength = 2
 spring_strength = 2
 motion_resistance = 0.2
 
+# Nodes closer than this do not act on each other
+minimum_distance = 0.3
+# Rows of the distance matrix computed at once by the exact repulsion
+block_rows = 256
+# Nodes in a quadtree cell before it is split
+leaf_size = 8
+
+
+def spring_edges(connections):
+    """Returns (starts, ends, weights) arrays for the positive-weight connections of a {(start, end): weight} mapping."""
+    edges = [(i, j, w) for (i, j), w in connections.items() if w > 0]
+    if not edges:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp), np.empty(0)
+    starts, ends, weights = zip(*edges)
+    return np.array(starts, dtype=np.intp), np.array(ends, dtype=np.intp), np.array(weights, dtype=np.float64)
+
+
+def accumulate(acceleration, nodes, forces):
+    """Adds each row of forces to the acceleration of its node."""
+    for axis in range(2):
+        acceleration[:, axis] += np.bincount(nodes, weights=forces[:, axis], minlength=len(acceleration))
+
+
+def exact_repulsion(positions):
+    """Returns the repulsion acceleration on every node from every other node."""
+    acceleration = np.zeros_like(positions)
+    x, y = positions[:, 0], positions[:, 1]
+    for first in range(0, len(positions), block_rows):
+        rx = x[None, :] - x[first:first + block_rows, None]
+        ry = y[None, :] - y[first:first + block_rows, None]
+        d2 = rx * rx + ry * ry
+        with np.errstate(divide='ignore'):
+            strength = -100 * repulsion_strength * d2 ** -1.5
+        strength[d2 < minimum_distance ** 2] = 0
+        acceleration[first:first + block_rows, 0] = (strength * rx).sum(axis=1)
+        acceleration[first:first + block_rows, 1] = (strength * ry).sum(axis=1)
+    return acceleration
+
+
+class QuadTree:
+    """Quadtree over node positions with the mass (node count) and centre of mass of each cell.
+    Cells are numbered in creation order with the root as cell 0, and the nodes of a leaf are
+    order[start[cell]:end[cell]]."""
+
+    def __init__(self, positions):
+        self.positions = positions
+        self.order = np.arange(len(positions))
+        self.size, self.mass, self.centre, self.start, self.end, self.children = [], [], [], [], [], []
+        low, high = positions.min(axis=0), positions.max(axis=0)
+        width = max(float((high - low).max()), minimum_distance)
+        self.build(0, len(positions), low, width, 0)
+        self.size = np.array(self.size)
+        self.mass = np.array(self.mass, dtype=np.float64)
+        self.centre = np.array(self.centre).reshape(-1, 2)
+        self.start = np.array(self.start, dtype=np.intp)
+        self.end = np.array(self.end, dtype=np.intp)
+        self.children = np.array(self.children, dtype=np.intp).reshape(-1, 4)
+
+    def build(self, start, end, corner, width, depth):
+        cell = len(self.size)
+        nodes = self.order[start:end]
+        self.size.append(width)
+        self.mass.append(end - start)
+        self.centre.append(self.positions[nodes].mean(axis=0))
+        self.start.append(start)
+        self.end.append(end)
+        self.children.append([-1, -1, -1, -1])
+        # Stop splitting small cells, and cells of coincident nodes that no split would separate
+        if end - start <= leaf_size or width < minimum_distance or depth > 48:
+            return cell
+        half = width / 2
+        quadrant = ((self.positions[nodes, 0] >= corner[0] + half).astype(np.intp) +
+                    2 * (self.positions[nodes, 1] >= corner[1] + half).astype(np.intp))
+        sort = np.argsort(quadrant, kind='stable')
+        self.order[start:end] = nodes[sort]
+        bounds = start + np.searchsorted(quadrant[sort], np.arange(5))
+        for q in range(4):
+            if bounds[q + 1] > bounds[q]:
+                child_corner = corner + half * np.array([q % 2, q // 2])
+                self.children[cell][q] = self.build(int(bounds[q]), int(bounds[q + 1]), child_corner, half, depth + 1)
+        return cell
+
+    def repulsion(self, theta):
+        """Returns the approximate repulsion acceleration on every node.
+        All (node, cell) pairs are processed together one tree level at a time.
+        The result is not continuous in the positions, as cells switch between far and near."""
+        positions = self.positions
+        acceleration = np.zeros_like(positions)
+        nodes = np.arange(len(positions))
+        cells = np.zeros(len(positions), dtype=np.intp)
+        while len(nodes):
+            r = self.centre[cells] - positions[nodes]
+            d = np.hypot(r[:, 0], r[:, 1])
+            leaf = (self.children[cells] == -1).all(axis=1)
+            # A cell containing the node is never far, as size / distance >= 1 / sqrt(2) > theta
+            far = (self.size[cells] < theta * d) & (d >= minimum_distance)
+            if far.any():
+                strength = -100 * repulsion_strength * self.mass[cells[far]] / (d[far] ** 3)
+                accumulate(acceleration, nodes[far], strength[:, None] * r[far])
+            near_leaf = ~far & leaf
+            if near_leaf.any():
+                # Exact forces from each node of the leaf
+                leaf_nodes, leaf_cells = nodes[near_leaf], cells[near_leaf]
+                counts = self.end[leaf_cells] - self.start[leaf_cells]
+                pair_nodes = np.repeat(leaf_nodes, counts)
+                first = np.repeat(self.start[leaf_cells] - np.cumsum(counts) + counts, counts)
+                others = self.order[first + np.arange(counts.sum())]
+                r_pair = positions[others] - positions[pair_nodes]
+                d_pair = np.hypot(r_pair[:, 0], r_pair[:, 1])
+                close = d_pair >= minimum_distance
+                strength = -100 * repulsion_strength / (d_pair[close] ** 3)
+                accumulate(acceleration, pair_nodes[close], strength[:, None] * r_pair[close])
+            # Open the remaining cells into their children
+            open_cells = ~far & ~leaf
+            children = self.children[cells[open_cells]]
+            nodes = np.repeat(nodes[open_cells], 4)
+            cells = children.reshape(-1)
+            nodes, cells = nodes[cells >= 0], cells[cells >= 0]
+        return acceleration
+
 
-def update(locations: list[Vector], velocities: list[Vector] | None, connections, time_step):
-    if velocities is None:
-        velocities = [Vector(0, 0) for _ in range(len(locations))]
-    new_locations, new_velocities = [x for x in locations], [x for x in velocities]
-    for update_node in range(len(locations)):
-        acceleration = Vector(0, 0)
-        loc = locations[update_node]
-        v = velocities[update_node]
-        for other_node in range(len(locations)):
-            r = locations[other_node] - loc
-            d = r.length()
-            if d < 0.3:
-                continue
-            # Repulsion force
-            strength = -100 / (d * d) * repulsion_strength
-            # Spring force
-            if (update_node, other_node) in connections:
-                weight = connections[(update_node, other_node)]
-                if weight > 0:
-                    strength += (d - weight) * spring_strength
-            acceleration = acceleration + r.parallel(strength)
-        # Air resistance
-        acceleration = acceleration + v.parallel(- (v.length() ** 2) * motion_resistance)
-        # Update node
-        new_locations[update_node] = (loc + (v * time_step))
-        new_velocities[update_node] = (v + (acceleration * time_step))
-    return new_locations, new_velocities
+def update_arrays(positions, velocities, edges, time_step, theta=0.0, damping=0.0):
+    """Advances the simulation by one time step, returning new (positions, velocities) N x 2 arrays.
+    edges - (starts, ends, weights) arrays from spring_edges
+    theta - 0 for exact repulsion, otherwise the Barnes-Hut opening ratio (cell size / distance), e.g. 0.5,
+            for coarse layout only as the approximation does not let the layout settle
+    damping - optional linear resistance, letting the layout come to rest as the air resistance fades at low speed"""
+    positions = np.asarray(positions, dtype=np.float64)
+    velocities = np.zeros_like(positions) if velocities is None else np.asarray(velocities, dtype=np.float64)
+    if len(positions) == 0:
+        return positions.copy(), velocities.copy()
+    if theta > 0:
+        acceleration = QuadTree(positions).repulsion(theta)
+    else:
+        acceleration = exact_repulsion(positions)
+    # Spring force
+    starts, ends, weights = edges
+    r = positions[ends] - positions[starts]
+    d = np.hypot(r[:, 0], r[:, 1])
+    stretched = d >= minimum_distance
+    strength = (d[stretched] - weights[stretched]) * spring_strength / d[stretched]
+    accumulate(acceleration, starts[stretched], strength[:, None] * r[stretched])
+    # Air resistance, acting along x for nodes that are almost stationary as Vector.parallel does
+    speed = np.hypot(velocities[:, 0], velocities[:, 1])
+    drag = -(speed ** 2) * motion_resistance
+    moving = speed >= .03
+    acceleration[moving] += velocities[moving] * (drag[moving] / speed[moving])[:, None]
+    acceleration[~moving, 0] += drag[~moving]
+    acceleration -= damping * velocities
+    # Update nodes
+    return positions + velocities * time_step, velocities + acceleration * time_step
 
 
+def update(locations: list[Vector], velocities: list[Vector] | None, connections, time_step, theta=0.0):
+    if velocities is not None:
+        velocities = [v.as_tuple() for v in velocities]
+    positions, velocities = update_arrays([x.as_tuple() for x in locations],
+                                          velocities,
+                                          spring_edges(connections),
+                                          time_step,
+                                          theta)
+    return [Vector(x, y) for x, y in positions], [Vector(x, y) for x, y in velocities]
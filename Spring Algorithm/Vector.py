@@ -15,6 +15,13 @@ class Vector:
     def __init__(self, x, y):
         self.array = np.array([x, y])
 
+    @classmethod
+    def view(cls, array):
+        """Wraps an existing 2 element array, such as a row of a coordinate array, without copying it."""
+        vector = cls.__new__(cls)
+        vector.array = array
+        return vector
+
     @staticmethod
     def _check_vector_type(other):
         if not isinstance(other, Vector):
@@ -19,8 +19,22 @@
 #   heu_x FLOAT, heu_y FLOAT
 # Connections contains records with cokumns
 #   start_id, end_id, weight
+# and is indexed on start_id (ConnectionsStart)
 
+# load_sql(filename, lazy=True) returns a SqliteNetwork, which keeps the node names and locations in memory
+# but leaves the connections in the file, fetching the connections leaving a node from the indexed
+# Connections table when route finding first needs them, with an LRU cache of recently used nodes
+# so very large maps can be routed without loading every connection
+# The file is opened read-only and must have the ConnectionsStart index, otherwise the table would be scanned
+# for every node; maps saved before the index existed can be indexed in place with
+#   python sqlite_File.py index 2023-SS-Campus-Map.sqlite
+
+import os
 import sqlite3
+import sys
+from collections import OrderedDict
+from collections.abc import Mapping
+from urllib.parse import quote
 
 from Network import Network
 from RFO_File import load_rfo
@@ -31,58 +45,171 @@ RFO_EXTENSION = '.rfo'
 
 
 def save_sql(filename, scale, units, network, map_filename):
+    # The map is written to a temporary file in a single transaction and renamed over the old file,
+    # so a crash part-way through leaves the old file as it was
+    temp_filename = filename + '.tmp'
+    if os.path.exists(temp_filename):
+        os.remove(temp_filename)
+    conn = sqlite3.connect(temp_filename)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute('CREATE TABLE Info (mapfilename VARCHAR, version VARCHAR, rfo_units VARCHAR, rfo_scale FLOAT)')
+            conn.execute(
+                'CREATE TABLE Nodes (id INTEGER PRIMARY KEY, name VARCHAR, loc_x FLOAT, loc_y FLOAT, heu_x FLOAT, heu_y FLOAT)')
+            conn.execute('CREATE TABLE Connections (start_id INTEGER, end_id INTEGER, weight FLOAT)')
+
+            conn.execute('INSERT INTO Info (mapfilename, version, rfo_units, rfo_scale) values (?, ?, ?, ?)',
+                         (map_filename, VERSION_CODE, units, scale))
+            conn.executemany('INSERT INTO Nodes (id, name, loc_x, loc_y, heu_x, heu_y) values (?, ?, ?, ?, ?, ?)',
+                             ((i, name, float(lx), float(ly), float(hx), float(hy))
+                              for i, (name, (lx, ly), (hx, hy)) in enumerate(zip(network.names,
+                                                                                  network.location_array.tolist(),
+                                                                                  network.heuristic_array.tolist()))))
+            conn.executemany('INSERT INTO Connections (start_id, end_id, weight) values (?, ?, ?)',
+                             network.iter_edges())
+            # Built after the inserts, which is faster than keeping it up to date row by row
+            conn.execute('CREATE INDEX ConnectionsStart ON Connections (start_id)')
+        # The finished file uses a rollback journal, so opening it read-only creates no -wal or -shm files
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.close()
+    except BaseException:
+        conn.close()
+        os.remove(temp_filename)
+        raise
+    # A write-ahead log left by a crashed writer of the old file must not be applied to the new one
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(filename + suffix):
+            os.remove(filename + suffix)
+    os.replace(temp_filename, filename)
+
+
+class SqliteConnections(Mapping):
+    """Read-only {(start, end): weight} view over the Connections table of a SqliteNetwork."""
+
+    def __init__(self, network):
+        self.network = network
+
+    def __getitem__(self, key):
+        i, j = key
+        if not 0 <= i < len(self.network.names):
+            raise KeyError(key)
+        for end, weight in self.network.edges_from(i):
+            if end == j:
+                return weight
+        raise KeyError(key)
+
+    def __iter__(self):
+        for i, j, _ in self.network.iter_edges():
+            yield i, j
+
+    def __len__(self):
+        return self.network.database().execute('SELECT COUNT(*) FROM Connections').fetchone()[0]
+
+
+class SqliteNetwork(Network):
+    """Network that reads its connections from a sqlite map file as they are needed.
+    The connections cannot be changed, load the map with load_sql(filename) to edit them."""
+
+    EDGE_CACHE_SIZE = 1024
+
+    def __init__(self, filename, nodes):
+        super().__init__(None)
+        sorted_nodes = sorted(nodes, key=lambda x: x['id'])
+        self.names = [node['name'] for node in sorted_nodes]
+        self.locations = [node['location'] for node in sorted_nodes]
+        self.heuristics = [node['heuristic'] for node in sorted_nodes]
+        self.filename = filename
+        self.connection = None
+        self.edge_cache: OrderedDict = OrderedDict()
+        self.connections = SqliteConnections(self)
+        # There are no CSR arrays, so code that reads them directly fails instead of seeing no connections
+        self.edge_offsets = None
+        self.edge_targets = None
+        self.edge_weights = None
+
+    def database(self):
+        """Returns the open read-only sqlite connection, opening it (once per process) if needed."""
+        if self.connection is None:
+            self.connection = connect_read_only(self.filename)
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __getstate__(self):
+        # Each process opens its own connection to the file
+        state = super().__getstate__()
+        state['connection'] = None
+        state['edge_cache'] = OrderedDict()
+        return state
+
+    def set_edges(self, edges):
+        raise TypeError("SqliteNetwork connections are read-only")
+
+    def iter_edges(self):
+        yield from self.database().execute(
+            'SELECT start_id, end_id, weight FROM Connections WHERE weight != 0 ORDER BY start_id, end_id')
+
+    def edges_from(self, node):
+        if node in self.edge_cache:
+            self.edge_cache.move_to_end(node)
+        else:
+            self.edge_cache[node] = self.database().execute(
+                'SELECT end_id, weight FROM Connections WHERE start_id = ? AND weight != 0 ORDER BY end_id',
+                (node,)).fetchall()
+            if len(self.edge_cache) > self.EDGE_CACHE_SIZE:
+                self.edge_cache.popitem(last=False)
+        return list(self.edge_cache[node])
+
+
+def connect_read_only(filename):
+    return sqlite3.connect(f"file:{quote(os.path.abspath(filename))}?mode=ro", uri=True)
+
+
+def has_connections_index(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'ConnectionsStart'").fetchone() \
+        is not None
+
+
+def index_sql(filename):
+    """Adds the ConnectionsStart index to a map file saved before it existed."""
     conn = sqlite3.connect(filename)
-    cur = conn.cursor()
-    cur.execute('DROP TABLE IF EXISTS Info')
-    cur.execute('DROP TABLE IF EXISTS Nodes')
-    cur.execute('DROP TABLE IF EXISTS Connections')
-    conn.commit()
-
-    cur.execute('CREATE TABLE Info (mapfilename VARCHAR, version VARCHAR, rfo_units VARCHAR, rfo_scale FLOAT)')
-    cur.execute(
-        'CREATE TABLE Nodes (id INTEGER PRIMARY KEY, name VARCHAR, loc_x FLOAT, loc_y FLOAT, heu_x FLOAT, heu_y FLOAT)')
-    cur.execute('CREATE TABLE Connections (start_id INTEGER, end_id INTEGER, weight FLOAT)')
-    conn.commit()
-
-    cur.execute('INSERT INTO Info (mapfilename, version, rfo_units, rfo_scale) values (?, ?, ?, ?)',
-                (map_filename, VERSION_CODE, units, scale))
-
-    for i, (name, location, heuristic) in enumerate(zip(network.names, network.locations, network.heuristics)):
-        location = location.as_tuple()
-        heuristic = heuristic.as_tuple()
-        cur.execute('INSERT INTO Nodes (id, name, loc_x, loc_y, heu_x, heu_y) values (?, ?, ?, ?, ?, ?)',
-                    (i, name, location[0], location[1], heuristic[0], heuristic[1]))
-
-    for (start_id, end_id), weight in network.connections.items():
-        cur.execute('INSERT INTO Connections (start_id, end_id, weight) values (?, ?, ?)',
-                    (start_id, end_id, weight))
-
-    conn.commit()
+    with conn:
+        conn.execute('CREATE INDEX IF NOT EXISTS ConnectionsStart ON Connections (start_id)')
     conn.close()
 
 
-def load_sql(filename):
-    conn = sqlite3.connect(filename)
+def load_sql(filename, lazy=False):
+    # lazy - return a SqliteNetwork that reads connections from the file as they are needed,
+    #   the file must have the ConnectionsStart index (see index_sql)
+    conn = connect_read_only(filename)
     cur = conn.cursor()
     conn.commit()
 
     cur.execute('SELECT * FROM Info')
     data = cur.fetchall()
-    filename, version, units, scale = data[0]
+    map_filename, version, units, scale = data[0]
 
     cur.execute('SELECT * FROM Nodes')
     data = cur.fetchall()
     nodes = [{'id': i, 'name': n, 'location': (lx, ly), 'heuristic': (hx, hy)}
              for (i, n, lx, ly, hx, hy) in data]
 
-    connections = [[0 for _ in range(len(nodes))] for _ in range(len(nodes))]
-    cur.execute('SELECT * FROM Connections')
-    data = cur.fetchall()
-    for s, e, w in data:
-        connections[s][e] = w
+    if lazy:
+        if not has_connections_index(conn):
+            conn.close()
+            raise ValueError(f"{filename} has no ConnectionsStart index for lazy loading, "
+                             f"add it with: python sqlite_File.py index {filename}")
+        network = SqliteNetwork(filename, nodes)
+    else:
+        cur.execute('SELECT start_id, end_id, weight FROM Connections')
+        network = Network(nodes, edges=cur.fetchall())
 
     conn.close()
-    return version, filename, float(scale), units, Network(nodes, connections)
+    return version, map_filename, float(scale), units, network
 
 
 def rfo_to_sql(filename):
@@ -97,3 +224,13 @@ def print_sql_contents(filename):
         print({'name': n, 'location': l, 'heuristic': h})
     for c in network.connections:
         print(c)
+
+
+if __name__ == "__main__":
+    # python sqlite_File.py index <files> - add the ConnectionsStart index to older map files
+    if len(sys.argv) > 2 and sys.argv[1] == "index":
+        for sql_filename in sys.argv[2:]:
+            index_sql(sql_filename)
+            print(sql_filename, "indexed")
+    else:
+        print("usage: python sqlite_File.py index <.sqlite files>")